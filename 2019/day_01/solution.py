@@ -2,6 +2,7 @@
 
 import functools
 import math
+import numpy as np
 
 def fuel_required(m):
     return math.floor(m / 3.0) - 2
@@ -37,6 +38,54 @@ def solve_part1(input):
 def solve_part2(input):
     return functools.reduce(lambda t, x: t + fuel_required_part2(x), input, 0)
 
+# Vectorized versions of the above, for when there are a lot of modules. Masses
+# are kept as int64 (so there's no float division), and totals are summed as
+# int64 too, which has plenty of room even for hundreds of millions of modules.
+def fuel_required_array(masses):
+    return masses // 3 - 2
+
+def solve_part1_array(masses):
+    return int(fuel_required_array(masses).sum(dtype=np.int64))
+
+# Rather than recursing per module, apply the fuel-for-fuel step to every
+# module at once, dropping modules as soon as they need no more fuel. Each step
+# divides the fuel by ~3, so this takes O(log(max mass)) passes.
+def solve_part2_array(masses):
+    total = 0
+    fuel = fuel_required_array(masses)
+    fuel = fuel[fuel > 0]
+    while fuel.size:
+        total += int(fuel.sum(dtype=np.int64))
+        fuel = fuel_required_array(fuel)
+        fuel = fuel[fuel > 0]
+    return total
+
+def parse_masses(data):
+    return np.array(data.split()).astype(np.int64)
+
+# Computes both answers for an input file in one pass, reading chunk_size bytes
+# at a time, so the whole file never has to fit in memory.
+def solve_file(path, chunk_size=1 << 24):
+    part1 = 0
+    part2 = 0
+    with open(path, "rb") as f:
+        tail = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            # Keep any partial line for the next chunk.
+            chunk = tail + chunk
+            end = chunk.rfind(b"\n") + 1
+            tail = chunk[end:]
+            masses = parse_masses(chunk[:end])
+            part1 += solve_part1_array(masses)
+            part2 += solve_part2_array(masses)
+        masses = parse_masses(tail)
+        part1 += solve_part1_array(masses)
+        part2 += solve_part2_array(masses)
+    return part1, part2
+
 if __name__=="__main__":
     # For a mass of 12, divide by 3 and round down to get 4, then subtract 2 to get 2.
     # For a mass of 14, dividing by 3 and rounding down still yields 4, so the fuel required is also 2.
@@ -53,3 +102,7 @@ if __name__=="__main__":
         f.seek(0)  # it'd be more efficient to compute both totals at once...
         part2_answer = solve_part2((int(l) for l in f))
         print(f"The answer to part 2 is {part2_answer}.")
+
+    # The vectorized versions should agree, however we chunk the file.
+    for chunk_size in [1, 10, 1 << 24]:
+        assert(solve_file("input", chunk_size) == (part1_answer, part2_answer))
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import bisect
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
@@ -267,6 +268,143 @@ class ImageGrid(object):
     def save(self, path):
         cv2.imwrite(path, self.scale_and_flip_image(self.canvas, 200, 200))
 
+# Version of ImageGrid for very large drawings. The canvas is split into
+# square tiles of tile_size pixels, and a tile is only allocated the first time
+# something is drawn on it, so the memory used depends on how much of the
+# canvas has been drawn on rather than on its bounds (which don't need to be
+# known up front). If spill_path is given, the tiles are kept in a
+# memory-mapped file at that path instead of in RAM, so the OS can page them
+# out.
+#
+# The tiles store 255 minus the actual color, so that a blank (white) tile is
+# all zeros. That way a new tile doesn't need to be filled in, and the pages of
+# it that are never drawn on are never touched (np.zeros and a freshly extended
+# file both give us zero pages for free).
+#
+# Note that, unlike ImageGrid, coordinates are not offset; the tile with index
+# (0, 0) has its bottom left corner at the origin.
+class TiledImageGrid(object):
+    def __init__(self, tile_size=256, spill_path=None):
+        self.tile_size = tile_size
+        self.spill_path = spill_path
+        # Maps tile index (ty, tx) to a slot in self.tiles.
+        self.slots = {}
+        # The tiles themselves; either a list of arrays, or a memory-mapped
+        # array of shape (capacity, tile_size, tile_size, 3).
+        self.tiles = []
+        if spill_path:
+            # Throw away anything left over from a previous drawing.
+            open(spill_path, "wb").close()
+            self._grow_spill_file(64)
+        self.pen_pos = Point(0, 0) # pen starts at the origin
+        self.pen_state = Grid.PenState.UP # pen starts up
+        self.pen_color = (255, 255, 255) # white
+
+    def _grow_spill_file(self, capacity):
+        tile_bytes = self.tile_size * self.tile_size * 3
+        if isinstance(self.tiles, np.memmap):
+            self.tiles.flush()
+        with open(self.spill_path, "ab") as f:
+            f.truncate(capacity * tile_bytes)
+        self.tiles = np.memmap(
+            self.spill_path, dtype='uint8', mode='r+',
+            shape=(capacity, self.tile_size, self.tile_size, 3))
+
+    # Returns the tile with the given index, allocating it if needed.
+    def get_tile(self, ty, tx):
+        slot = self.slots.get((ty, tx))
+        if slot is None:
+            slot = len(self.slots)
+            self.slots[(ty, tx)] = slot
+            if self.spill_path:
+                if slot == len(self.tiles):
+                    self._grow_spill_file(2 * len(self.tiles))
+            else:
+                self.tiles.append(np.zeros(
+                    (self.tile_size, self.tile_size, 3), dtype='uint8'))
+        return self.tiles[slot]
+
+    def get_tile_count(self):
+        return len(self.slots)
+
+    def set_pen_color(self, color):
+        self.pen_color = color
+
+    def get_pen_pos(self):
+        return self.pen_pos
+
+    def pen_down(self):
+        self.pen_state = Grid.PenState.DOWN
+
+    def pen_up(self):
+        self.pen_state = Grid.PenState.UP
+
+    # Same as cv2.line(), except that the line may cross any number of tiles.
+    # We draw the line on every tile it passes through, with the coordinates
+    # translated to that tile; cv2 takes care of clipping.
+    def line(self, p0: Point, p1: Point, color, thickness=1):
+        t = self.tile_size
+        color = tuple(255 - c for c in color)
+        for ty in range(min(p0.y, p1.y) // t, max(p0.y, p1.y) // t + 1):
+            for tx in range(min(p0.x, p1.x) // t, max(p0.x, p1.x) // t + 1):
+                q0 = (p0.x - tx * t, p0.y - ty * t)
+                q1 = (p1.x - tx * t, p1.y - ty * t)
+                # Don't allocate tiles a diagonal line only passes near.
+                visible, _, _ = cv2.clipLine((0, 0, t, t), q0, q1)
+                if visible:
+                    cv2.line(self.get_tile(ty, tx), q0, q1, color, thickness)
+
+    def move_to(self, p: Point):
+        if self.pen_state == Grid.PenState.DOWN:
+            self.line(self.pen_pos, p, self.pen_color)
+        self.pen_pos = p
+
+    # Shrinks a (tile_size x tile_size) tile by a factor of f, taking the max
+    # over each f x f block. numpy is much faster at reducing over leading
+    # axes than trailing ones, so we do the rows first, then move the columns
+    # to the front and do them.
+    def _shrink_tile(self, tile, f):
+        t = self.tile_size
+        n = t // f
+        rows = tile.reshape(n, f, t * 3).max(axis=1).reshape(n, n, f, 3)
+        return np.ascontiguousarray(rows.transpose(2, 0, 1, 3)).max(axis=0)
+
+    # Returns the whole drawing as one image, shrunk by a power of two so that
+    # it's no more than max_size pixels on a side. Each pixel in the result is
+    # the darkest of the pixels it covers, so thin lines don't disappear. +y
+    # is up, as for ImageGrid.
+    def to_image(self, max_size=4096):
+        t = self.tile_size
+        assert(t & (t - 1) == 0) # tile size must be a power of two
+        if not self.slots:
+            return np.full((1, 1, 3), 255, dtype='uint8')
+        ty0 = min(ty for ty, _ in self.slots)
+        tx0 = min(tx for _, tx in self.slots)
+        rows = (max(ty for ty, _ in self.slots) - ty0 + 1) * t
+        cols = (max(tx for _, tx in self.slots) - tx0 + 1) * t
+        f = 1
+        while max(rows, cols) > max_size * f:
+            f *= 2
+
+        # Built inverted, like the tiles, so the darkest pixel is the max.
+        img = np.zeros((-(-rows // f), -(-cols // f), 3), dtype='uint8')
+        for (ty, tx), slot in self.slots.items():
+            small = self._shrink_tile(self.tiles[slot], min(f, t))
+            if f <= t:
+                n = t // f
+                y, x = (ty - ty0) * n, (tx - tx0) * n
+                region = img[y:y + n, x:x + n]
+                np.maximum(region, small, out=region)
+            else:
+                # Several tiles per pixel; each tile shrinks to one pixel.
+                g = f // t
+                y, x = (ty - ty0) // g, (tx - tx0) // g
+                np.maximum(img[y, x], small[0, 0], out=img[y, x])
+        return cv2.flip(255 - img, 0)
+
+    def save(self, path, max_size=4096):
+        cv2.imwrite(path, self.to_image(max_size))
+
 # Converts a wire direction (e.g. "R10") into a position, given a starting
 # position.
 def wire_direction_to_position(pos: Point, inst: str):
@@ -336,12 +474,40 @@ def draw_wires(wires, path=None):
     else:
         grid.show()
 
+# Like draw_wires, but draws on a TiledImageGrid, so there's no need to find the
+# bounds first, and only the parts of the canvas the wires pass through use any
+# memory. The image is shrunk to at most max_size pixels on a side when it's
+# saved.
+def draw_wires_tiled(wires, path, spill_path=None, max_size=4096):
+    colors = [
+        [0, 0, 255], # opencv assumes BGR order
+        [0, 255, 0],
+        [255, 0, 0],
+    ]
+    grid = TiledImageGrid(spill_path=spill_path)
+    for i, w in enumerate(wires):
+        grid.set_pen_color(colors[i % len(colors)])
+        grid.pen_up()
+        grid.move_to(Point(0, 0))
+        grid.pen_down()
+        p = Point(0, 0)
+        for inst in w:
+            p = wire_direction_to_position(p, inst)
+            grid.move_to(p)
+    print(f"Drew wires using {grid.get_tile_count()} tiles, saving image to {path}.")
+    grid.save(path, max_size)
+
 def manhattan_dist(p0: Point, p1: Point):
     return abs(p1.x - p0.x) + abs(p1.y - p0.y)
 
-Segment = namedtuple("Segment", ["x0", "y0", "x1", "y1", "start_length"])
+# A segment of wire. start_length is the length of wire before the start of
+# the segment (used to compute the signal delay); wire is the index of the
+# wire the segment belongs to.
+Segment = namedtuple(
+    "Segment", ["x0", "y0", "x1", "y1", "start_length", "wire"],
+    defaults=[0])
 
-def convert_wire(wire):
+def convert_wire(wire, wire_index=0):
     segments = []
     pos = Point(0, 0)
     length = 0
@@ -350,75 +516,194 @@ def convert_wire(wire):
         # segments must be horizontal or vertical
         assert((pos.x == new_pos.x and pos.y != new_pos.y) or
                (pos.x != new_pos.x and pos.y == new_pos.y))
-        segments.append(Segment(pos.x, pos.y, new_pos.x, new_pos.y, length))
+        segments.append(Segment(pos.x, pos.y, new_pos.x, new_pos.y, length, wire_index))
         length += abs(new_pos.x - pos.x) + abs(new_pos.y - pos.y)
         pos = new_pos
     return segments
 
+# Length of wire from the start of the wire to the point p on segment s.
+def delay_to(p: Point, s: Segment):
+    return s.start_length + abs(p.x - s.x0) + abs(p.y - s.y0)
+
+# A whole wire as NumPy arrays, with one entry per segment. Same fields as
+# Segment (except wire).
+WireArrays = namedtuple("WireArrays", ["x0", "y0", "x1", "y1", "start_length"])
+
+# Parses a wire's directions (e.g. "R8,U5,L5,D3") straight into a WireArrays,
+# without creating any Python objects per segment.
+#
+# The numbers are parsed by giving each digit its place value (10 to the power
+# of the number of characters between it and the end of its token) and adding
+# them up per token. After that each segment's (dx, dy) comes from its
+# direction letter, and the endpoints and lengths are just cumulative sums.
+def parse_wire(directions):
+    if isinstance(directions, str):
+        directions = directions.encode("ascii")
+    data = np.frombuffer(directions.strip(), dtype=np.uint8)
+
+    is_comma = data == ord(",")
+    starts = np.concatenate(([0], np.flatnonzero(is_comma) + 1))
+    ends = np.concatenate((np.flatnonzero(is_comma), [len(data)]))
+    token = np.cumsum(is_comma)
+    place = ends[token] - np.arange(len(data)) - 1
+    is_digit = (data >= ord("0")) & (data <= ord("9"))
+    values = np.where(
+        is_digit,
+        (data.astype(np.int64) - ord("0")) * np.power(10, place, dtype=np.int64),
+        0)
+    distance = np.add.reduceat(values, starts)
+
+    letter = data[starts]
+    assert(np.all(np.isin(letter, np.frombuffer(b"RDLU", dtype=np.uint8))))
+    assert(np.all(distance > 0))
+    dx = np.where(letter == ord("R"), distance, 0) - np.where(letter == ord("L"), distance, 0)
+    dy = np.where(letter == ord("U"), distance, 0) - np.where(letter == ord("D"), distance, 0)
+
+    x1 = np.cumsum(dx)
+    y1 = np.cumsum(dy)
+    end_length = np.cumsum(distance)
+    return WireArrays(x1 - dx, y1 - dy, x1, y1, end_length - distance)
+
+# A Fenwick (binary indexed) tree over n slots, each of which is either set or
+# not. Setting or clearing a slot, counting the set slots before a given one,
+# and finding the k-th set slot all take O(log n).
+class FenwickTree(object):
+    def __init__(self, n):
+        self.n = n
+        self.tree = [0] * (n + 1)
+        self.top = 1 << n.bit_length()
+
+    # Adds delta (1 to set, -1 to clear) to slot i.
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    # Returns the number of set slots before slot i.
+    def count_before(self, i):
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    # Returns the k-th set slot (counting from 0), by walking down the tree
+    # from the top, skipping any block with no more than k set slots.
+    def find(self, k):
+        i = 0
+        step = self.top
+        while step:
+            if i + step <= self.n and self.tree[i + step] <= k:
+                i += step
+                k -= self.tree[i]
+            step >>= 1
+        return i
+
+# Finds every point where two different wires cross, using a sweep line.
+#
+# We sweep a vertical line from left to right over the wires. Horizontal
+# segments are "active" from when the line reaches their left end until it
+# passes their right end. Each horizontal segment has a fixed slot in a
+# FenwickTree, in order of y, which is set while the segment is active. When
+# the line reaches a vertical segment, the horizontal segments it crosses are
+# exactly the active ones whose y is within the vertical segment: bisecting
+# the y values gives the range of slots, and the tree finds each set slot in
+# that range. This takes O((n + k) log n) for n segments and k crossings,
+# instead of comparing every pair of segments.
+#
+# wires is a list of WireArrays. Calls handle_intersection(p, s0, s1) for each
+# crossing, where s0 is the vertical segment and s1 the horizontal one.
+# Segments from the same wire crossing each other are ignored, and so are
+# parallel segments which overlap (the puzzle doesn't count those).
+def find_intersections(wires, handle_intersection, chunk_size=1 << 16):
+    x0 = np.concatenate([w.x0 for w in wires])
+    y0 = np.concatenate([w.y0 for w in wires])
+    x1 = np.concatenate([w.x1 for w in wires])
+    y1 = np.concatenate([w.y1 for w in wires])
+    start_length = np.concatenate([w.start_length for w in wires])
+    wire = np.concatenate(
+        [np.full(len(w.x0), i) for i, w in enumerate(wires)])
+    if np.any((x0 != x1) & (y0 != y1)):
+        raise ValueError("Segment x and y both vary!")
+
+    def segment(i):
+        return Segment(int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i]),
+                       int(start_length[i]), int(wire[i]))
+
+    # Events are (x, kind, y0, y1, i), where i is the index of the segment.
+    # Sorting by kind means that, for the same x, we add horizontal segments
+    # before checking vertical ones, and remove them after, so that segments
+    # which just touch are counted.
+    ADD, CHECK, REMOVE = 0, 1, 2
+    i = np.arange(len(x0))
+    h = y0 == y1
+    v = ~h
+    ex = np.concatenate((np.minimum(x0, x1)[h], x0[v], np.maximum(x0, x1)[h]))
+    ekind = np.concatenate((
+        np.full(np.count_nonzero(h), ADD),
+        np.full(np.count_nonzero(v), CHECK),
+        np.full(np.count_nonzero(h), REMOVE)))
+    ey0 = np.concatenate((y0[h], np.minimum(y0, y1)[v], y0[h]))
+    ey1 = np.concatenate((y0[h], np.maximum(y0, y1)[v], y0[h]))
+    ei = np.concatenate((i[h], i[v], i[h]))
+    order = np.lexsort((ei, ey1, ey0, ekind, ex))
+
+    # Slots for the horizontal segments, sorted by (y, i).
+    horizontal = i[h][np.lexsort((i[h], y0[h]))]
+    slot_y = y0[horizontal].tolist()
+    slot = np.zeros(len(x0), dtype=np.int64)
+    slot[horizontal] = np.arange(len(horizontal))
+    slot = slot.tolist()
+    horizontal = horizontal.tolist()
+    active = FenwickTree(len(horizontal))
+    # Only turn a chunk of the events into Python ints at a time.
+    for c in range(0, len(order), chunk_size):
+        chunk = order[c:c + chunk_size]
+        for x, kind, lo, hi, j in zip(ex[chunk].tolist(), ekind[chunk].tolist(),
+                                      ey0[chunk].tolist(), ey1[chunk].tolist(),
+                                      ei[chunk].tolist()):
+            if kind == ADD:
+                active.add(slot[j], 1)
+            elif kind == REMOVE:
+                active.add(slot[j], -1)
+            else:
+                a = active.count_before(bisect.bisect_left(slot_y, lo))
+                b = active.count_before(bisect.bisect_right(slot_y, hi))
+                for t in range(a, b):
+                    s = active.find(t)
+                    k = horizontal[s]
+                    if wire[k] != wire[j]:
+                        handle_intersection(Point(x, slot_y[s]), segment(j),
+                                            segment(k))
+
+# wires may be given as strings of directions (e.g. "R8,U5") or as lists of
+# directions (e.g. ["R8", "U5"]).
 def solve(wires, handle_intersection):
-    wires = list(map(convert_wire, wires))
-    assert(len(wires) == 2)
-    print(wires)
-
-    hs = sorted(filter(lambda s: s.y0 == s.y1, wires[1]), key=lambda s: s.y0)
-    vs = sorted(filter(lambda s: s.x0 == s.x1, wires[1]), key=lambda s: s.x0)
-    print(hs, vs)
-
-    for s0 in wires[0]:
-        print(f"Checking segment {s0}.")
-        # We need the x and y coordinates to be ordered ascending for the
-        # intersection test.
-        s0x0 = min(s0.x0, s0.x1)
-        s0x1 = max(s0.x0, s0.x1)
-        s0y0 = min(s0.y0, s0.y1)
-        s0y1 = max(s0.y0, s0.y1)
-        if s0x0 == s0x1:
-            s0x = s0x0
-            print(f"  Segment is vertical (x = {s0x}).")
-            for s1 in hs:
-                s1x0 = min(s1.x0, s1.x1)
-                s1x1 = max(s1.x0, s1.x1)
-                s1y0 = min(s1.y0, s1.y1)
-                s1y1 = max(s1.y0, s1.y1)
-                assert(s1y0 == s1y1)
-                s1y = s1y0
-                print(f"  Comparing to segment {s1}.")
-                if s1y < s0y0:
-                    # h seg is below us
-                    print("  Segment below, continuing.")
-                    continue
-                elif s1y >= s0y0 and s1y <= s0y1:
-                    # h seg inside our bounds, check other coord
-                    print("  Possible match.")
-                    if s1x0 <= s0x and s1x1 >= s0x:
-                        handle_intersection(Point(s0x, s1y), s0, s1)
-                else:
-                    # h seg must be above us
-                    print("  Segment above, breaking loop.")
-                    break
-        elif s0y0 == s0y1:
-            s0y = s0y0
-            print(f"  Segment is horizontal (y = {s0y}).")
-            for s1 in vs:
-                s1x0 = min(s1.x0, s1.x1)
-                s1x1 = max(s1.x0, s1.x1)
-                s1y0 = min(s1.y0, s1.y1)
-                s1y1 = max(s1.y0, s1.y1)
-                assert(s1.x0 == s1.x1)
-                s1x = s1x0
-                print(f"  Comparing to segment {s1}.")
-                if s1x < s0x0:
-                    print("  Segment to the left, continuing.")
-                    continue
-                elif s1x >= s0x0 and s1x <= s0x1:
-                    print("  Possible match.")
-                    if s1y0 <= s0y and s1y1 >= s0y:
-                        handle_intersection(Point(s1x, s0y), s0, s1)
-                else:
-                    print(" Segment to the right, breaking loop.")
-                    break
-        else:
-            raise ValueError("Segment {s0} x and y both vary!")
+    wires = [parse_wire(w if isinstance(w, (str, bytes)) else ",".join(w))
+             for w in wires]
+    find_intersections(wires, handle_intersection)
+
+# Solves both parts with a single pass over the intersections. Returns the
+# distance to the intersection closest to the origin, and the smallest signal
+# delay of any intersection.
+def solve_both(wires):
+    min_distance = None
+    min_delay = None
+
+    def handle_intersection(p: Point, s0: Segment, s1: Segment):
+        nonlocal min_distance, min_delay
+        if p == Point(0, 0):
+            return
+        d = manhattan_dist(p, Point(0, 0))
+        if min_distance is None or d < min_distance:
+            min_distance = d
+        d = delay_to(p, s0) + delay_to(p, s1)
+        if min_delay is None or d < min_delay:
+            min_delay = d
+
+    solve(wires, handle_intersection)
+    return min_distance, min_delay
 
 def solve_part1(wires):
     min_distance = None
@@ -491,16 +776,17 @@ test_cases = [
 ]
 
 if __name__ == "__main__":
-    # for tc in test_cases:
-    #     print(tc["wires"])
-    #     assert(solve_part1(tc["wires"]) == tc["solution_part1"])
-    #     assert(solve_part2(tc["wires"]) == tc["solution_part2"])
+    for tc in test_cases:
+        part1, part2 = solve_both(tc["wires"])
+        assert(part1 == tc["solution_part1"])
+        assert(part2 == tc["solution_part2"])
 
-    with open("input", "r") as f:
-        wires = [l.rstrip().split(",") for l in f]
-    print(wires)
+    with open("input", "rb") as f:
+        wires = [l for l in f if l.strip()]
 
     # The answer to part 1 should be 557 (we already submitted it) so check
     # that here.
-    assert(solve_part1(wires) == 557)
-    solve_part2(wires)
+    part1, part2 = solve_both(wires)
+    assert(part1 == 557)
+    print(f"Closest intersection point to origin is distance {part1} away.")
+    print(f"Smallest signal delay to an intersection is {part2}.")
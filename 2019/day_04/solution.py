@@ -1,10 +1,20 @@
-def solve_part1_exhaustive(lower_bound, upper_bound):
+import functools
+import itertools
+import random
+import time
+
+# The exhaustive solvers print every number they check by default; pass a
+# different log function (e.g. one that does nothing) to change that.
+def quiet(*args, **kwargs):
+    pass
+
+def solve_part1_exhaustive(lower_bound, upper_bound, log=print):
     # Check each number for:
     #   1. two adjacent digits must be the same
     #   2. the digits never decrease from left to right
     count = 0
     for x in range(lower_bound, upper_bound):
-        print(f"Checking {x}")
+        log(f"Checking {x}")
         s = str(x)
         digits_decrease = False
         found_double = False
@@ -16,19 +26,20 @@ def solve_part1_exhaustive(lower_bound, upper_bound):
                 break
 
         if digits_decrease:
-            print("Digits decrease, skipped.")
+            log("Digits decrease, skipped.")
             continue
 
         if not found_double:
-            print("No double, skipped.")
+            log("No double, skipped.")
             continue
 
-        print(f"Accepted {x} as possible passcode.")
+        log(f"Accepted {x} as possible passcode.")
         count += 1
 
-    print(f"There are {count} possible passwords in the range {lower_bound} - {upper_bound}.")
+    log(f"There are {count} possible passwords in the range {lower_bound} - {upper_bound}.")
+    return count
 
-def solve_part2_exhaustive(lower_bound, upper_bound):
+def solve_part2_exhaustive(lower_bound, upper_bound, log=print):
     # Check each number for:
     #   1. two adjacent digits must be the same
     #   2. the digits never decrease from left to right
@@ -36,20 +47,20 @@ def solve_part2_exhaustive(lower_bound, upper_bound):
     #      of matching digits
     count = 0
     for x in range(lower_bound, upper_bound):
-        print(f"Checking {x}: ", end='')
+        log(f"Checking {x}: ", end='')
         s = str(x)
         digits_decrease = False
         found_double = False
         for i in range(len(s) - 1):
             if not found_double and s[i] == s[i+1]:
                 found_double = True
-                print(f"i={i}, s[i]={s[i]}, s[i+1]={s[i+1]}")
+                log(f"i={i}, s[i]={s[i]}, s[i+1]={s[i+1]}")
                 # double check that we're not part of a larger group
                 if i < len(s) - 2 and s[i] == s[i+2]:
-                    print(f"s[i+2]={s[i+2]}")
+                    log(f"s[i+2]={s[i+2]}")
                     found_double = False
                 if i > 0 and s[i] == s[i-1]:
-                    print(f"s[i-1]={s[i-1]}")
+                    log(f"s[i-1]={s[i-1]}")
                     found_double = False
 
             if int(s[i+1]) < int(s[i]):
@@ -57,20 +68,21 @@ def solve_part2_exhaustive(lower_bound, upper_bound):
                 break
 
         if digits_decrease:
-            print("Digits decrease, skipped.")
+            log("Digits decrease, skipped.")
             continue
 
         if not found_double:
-            print("No double, skipped.")
+            log("No double, skipped.")
             continue
 
-        print("Accepted")
+        log("Accepted")
         count += 1
 
-    print(f"There are {count} possible passwords in the range {lower_bound} - {upper_bound}.")
+    log(f"There are {count} possible passwords in the range {lower_bound} - {upper_bound}.")
+    return count
 
 
-def solve_part1():
+def solve_part1(lower_bound, upper_bound):
     # Note that there is only one possible password for a 2 digit number, since
     # the digits must be the same (e.g. '00'). For more than two digits, we can
     # first find the total number of possible passwords, then subtract those
@@ -105,11 +117,180 @@ def solve_part1():
     #
     # This pattern holds for any number of digits.
     #
-    # But how do we deal with the range given in the problem?
-    pass
+    # But how do we deal with the range given in the problem? Rather than
+    # trying to find a closed form, we can count with a "digit DP" (see
+    # count_passwords, below): build numbers one digit at a time, and count the
+    # ways to finish a number from each (digits left, last digit, ...) state.
+    # There are only a handful of states, so this is fast for any range.
+    return count_passwords(lower_bound, upper_bound)
+
+def solve_part2(lower_bound, upper_bound):
+    return count_passwords(lower_bound, upper_bound, exact_double=True)
+
+# Returns True if a finished run of n equal digits counts as the double the
+# password needs. In part 2 (exact_double) the run must be exactly two long.
+def is_double(n, exact_double):
+    return n == 2 if exact_double else n >= 2
+
+# Returns the state after appending digit d to a number in the given state. The
+# state is (last digit, length of the current run of equal digits, whether
+# we've already found a double). Runs longer than 3 look the same as runs of 3
+# for both parts, so we stop counting there (this keeps the number of states
+# small).
+def next_state(state, d, exact_double):
+    last, run, found = state
+    if d == last:
+        return (d, min(run + 1, 3), found)
+    return (d, 1, found or is_double(run, exact_double))
+
+# The number of ways to append `remaining` more digits to a number in the given
+# state so that the digits never decrease and there's a double somewhere.
+@functools.lru_cache(maxsize=None)
+def count_completions(remaining, state, exact_double):
+    last, run, found = state
+    if remaining == 0:
+        return int(found or is_double(run, exact_double))
+    return sum(
+        count_completions(
+            remaining - 1, next_state(state, d, exact_double), exact_double)
+        for d in range(last, 10))
+
+# Counts the valid passwords x with 0 <= x < n.
+def count_passwords_below(n, exact_double=False):
+    if n <= 0:
+        return 0
+    digits = [int(c) for c in str(n)]
+
+    # Every valid number with fewer digits than n is below n. Note a number
+    # can't start with 0 (0 itself is never a valid password).
+    total = 0
+    for length in range(1, len(digits)):
+        for d in range(1, 10):
+            total += count_completions(
+                length - 1, (d, 1, False), exact_double)
+
+    # For numbers with the same number of digits as n, pick how many leading
+    # digits they share with n; the next digit must then be smaller than the
+    # one in n (and no smaller than the digit before it), and the rest can be
+    # anything valid.
+    state = None
+    for i, n_d in enumerate(digits):
+        lowest = 1 if state is None else state[0]
+        for d in range(lowest, n_d):
+            if state is None:
+                s = (d, 1, False)
+            else:
+                s = next_state(state, d, exact_double)
+            total += count_completions(len(digits) - i - 1, s, exact_double)
+        if n_d < lowest:
+            # n's own digits decrease here, so no number with a longer prefix
+            # in common with n can be valid.
+            break
+        state = (n_d, 1, False) if state is None else next_state(
+            state, n_d, exact_double)
+    return total
+
+# Counts the valid passwords in [lower_bound, upper_bound). Takes time
+# polynomial in the number of digits, so huge ranges are no problem.
+def count_passwords(lower_bound, upper_bound, exact_double=False):
+    return (count_passwords_below(upper_bound, exact_double) -
+            count_passwords_below(lower_bound, exact_double))
+
+# Returns True if the digits (which must not decrease) contain a double, using
+# the lengths of the runs of equal digits.
+def has_double(digits, exact_double=False):
+    runs = [len(list(g)) for _, g in itertools.groupby(digits)]
+    if exact_double:
+        return 2 in runs
+    return max(runs) >= 2
+
+# Yields the valid passwords in [lower_bound, upper_bound), in increasing order.
+#
+# Instead of checking every number in the range, we only generate numbers
+# whose digits never decrease, in increasing order. For each number of digits,
+# we start from the smallest such number >= lower_bound: keep its digits up to
+# the first one that's smaller than the digit before it, then repeat that
+# digit to the end. The next one after that is found by adding one to the last
+# digit that isn't a 9, and setting every digit after it to the same value. We
+# stop as soon as we reach upper_bound, so the time taken only depends on how
+# many numbers there are in the range with digits that never decrease.
+def generate_passwords(lower_bound, upper_bound, exact_double=False):
+    lower_bound = max(lower_bound, 1)
+    if lower_bound >= upper_bound:
+        return
+    for length in range(len(str(lower_bound)), len(str(upper_bound - 1)) + 1):
+        lo = max(lower_bound, 10 ** (length - 1))
+        hi = min(upper_bound, 10 ** length)
+        digits = [int(c) for c in str(lo)]
+        for i in range(1, length):
+            if digits[i] < digits[i - 1]:
+                digits[i:] = [digits[i - 1]] * (length - i)
+                break
+        while True:
+            x = int("".join(map(str, digits)))
+            if x >= hi:
+                break
+            if has_double(digits, exact_double):
+                yield x
+            i = length - 1
+            while i >= 0 and digits[i] == 9:
+                i -= 1
+            if i < 0:
+                break
+            digits[i:] = [digits[i] + 1] * (length - i)
+
+# Compares how fast generate_passwords is with solve_part2_exhaustive.
+def benchmark_generate_passwords(lower_bound, upper_bound):
+    t0 = time.perf_counter()
+    count = solve_part2_exhaustive(lower_bound, upper_bound, log=quiet)
+    exhaustive_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    passwords = list(generate_passwords(lower_bound, upper_bound, exact_double=True))
+    generate_time = time.perf_counter() - t0
+    assert(len(passwords) == count)
+
+    n = upper_bound - lower_bound
+    print(f"solve_part2_exhaustive: {exhaustive_time:0.3f} s "
+          f"({n / exhaustive_time:0.0f} numbers / s).")
+    print(f"generate_passwords: {generate_time:0.3f} s "
+          f"({n / generate_time:0.0f} numbers / s, "
+          f"{exhaustive_time / generate_time:0.0f}x faster).")
+
+# Checks count_passwords against the exhaustive solvers, on the puzzle range
+# and some random ones (from a fixed seed, so any failure can be reproduced).
+def check_count_passwords(lower_bound, upper_bound, trials=10, seed=0):
+    rng = random.Random(seed)
+    ranges = [(lower_bound, upper_bound), (0, 10000)]
+    for _ in range(trials):
+        lo = rng.randrange(0, 10 ** rng.randint(1, 6))
+        ranges.append((lo, lo + rng.randrange(0, 100000)))
+    for lo, hi in ranges:
+        assert(count_passwords(lo, hi) ==
+               solve_part1_exhaustive(lo, hi, log=quiet))
+        assert(count_passwords(lo, hi, exact_double=True) ==
+               solve_part2_exhaustive(lo, hi, log=quiet))
+        assert(count_passwords(lo, hi) ==
+               sum(1 for _ in generate_passwords(lo, hi)))
+        assert(count_passwords(lo, hi, exact_double=True) ==
+               sum(1 for _ in generate_passwords(lo, hi, exact_double=True)))
+    # A small range of huge numbers, which generate_passwords should get
+    # straight to, rather than walking up from the smallest 18 digit number.
+    lo, hi = 199999999999999990, 200000000000000000
+    assert(list(generate_passwords(lo, hi)) == [199999999999999999])
+    print(f"count_passwords and generate_passwords agree with the exhaustive solvers on {len(ranges)} ranges.")
 
 if __name__ == '__main__':
     lower_bound = 356261
     upper_bound = 846303
     # solve_part1_exhaustive(lower_bound, upper_bound)
-    solve_part2_exhaustive(lower_bound, upper_bound)
+    # solve_part2_exhaustive(lower_bound, upper_bound)
+    check_count_passwords(lower_bound, upper_bound)
+    print(f"Part 1: there are {solve_part1(lower_bound, upper_bound)} possible passwords.")
+    print(f"Part 2: there are {solve_part2(lower_bound, upper_bound)} possible passwords.")
+
+    benchmark_generate_passwords(lower_bound, upper_bound)
+
+    # Since the counting doesn't depend on the size of the range, we can do
+    # much bigger ones too.
+    print(f"There are {count_passwords(0, 10 ** 18)} passwords with up to 18 digits (part 1 rules).")
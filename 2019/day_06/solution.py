@@ -1,3 +1,8 @@
+import numpy as np
+import os
+import tempfile
+import time
+
 from collections import defaultdict
 
 class Body:
@@ -61,56 +66,288 @@ def find_shortest_path(g, src_label, dst_label):
         for c in b.children:
             append_if_not_visted(c, l + 1)
 
-if __name__ == '__main__':
-    # Build the tree of orbits.
-    g = build_orbit_graph("input")
+# Maps between body labels and integer ids. Rather than a dict (which gets slow
+# with millions of labels), the labels are kept as one sorted NumPy array, and
+# the id of a label is its position in the array. Labels of up to 8 bytes are
+# packed into big-endian integers, which sort in the same order as the labels
+# but much faster.
+class LabelIndex:
+    def __init__(self, keys):
+        self.keys = keys
 
-    # Part 1
-    #
-    # We need to get the total number of direct and indirect orbits in the map.
-    # To do this, just count all orbits recursively from COM using a BFS.
-    q = [('COM', 0)]
-    orbits = 0
-    while q:
-        body, d = q.pop()
-        print(f"{body} {d}")
-        orbits += d
-        for x in g[body].children:
-            q.append((x.label, d+1))
+    # Builds the index from a list of arrays of labels (dtype "S"). Returns the
+    # index and an array with the id of each of the given labels.
+    @staticmethod
+    def build(label_arrays):
+        width = max([a.dtype.itemsize for a in label_arrays] + [1])
+        if width <= 8:
+            keys = np.concatenate(
+                [a.astype("S8").view(">u8") for a in label_arrays])
+            keys = keys.astype(np.uint64)
+        else:
+            keys = np.concatenate(
+                [a.astype(f"S{width}") for a in label_arrays])
+        keys, ids = np.unique(keys, return_inverse=True)
+        return LabelIndex(keys), ids.reshape(-1)
 
-    print(f"Got {orbits} total orbits.")
+    def __len__(self):
+        return len(self.keys)
 
-    # Part 2
-    #
-    # Now we need to figure out the minimum length path between the body we are
-    # currently orbiting (we are represented by the node YOU) and the body Santa
-    # is currently orbiting (SAN). We can just do a BFS from YOU to SAN; since
-    # we're doing a BFS, the first solution we find will have the minimum
-    # length.
-    #
-    # For fun let's carry around the path we took so we can print the path found
-    # at the end.
-    q = [('YOU', 0, ['YOU'])]
-    visited = set()
-    while q:
-        label, l, path = q.pop()
-        visited.add(label)
+    def id(self, label):
+        key = np.array([label.encode("ascii")], dtype=f"S{max(len(label), 1)}")
+        if self.keys.dtype.kind == "u":
+            if len(label) > 8:
+                raise KeyError(label)
+            key = key.astype("S8").view(">u8").astype(np.uint64)
+        i = int(np.searchsorted(self.keys, key[0]))
+        if i == len(self.keys) or self.keys[i] != key[0]:
+            raise KeyError(label)
+        return i
 
-        print(f"Considering {label} at depth {l}.")
+    def label(self, i):
+        key = self.keys[i:i + 1]
+        if key.dtype.kind == "u":
+            key = key.astype(">u8").view("S8")
+        return key[0].decode("ascii")
 
-        if label == 'SAN':
-            # We're done! Note the -1 here is because we don't need to go into
-            # orbit around SAN, just around the body he's orbiting.
-            print(f"Min path from YOU to SAN has length {l-1}, path is {path}.")
-            break
+# A more compact version of the orbit graph. Each body gets an integer id (see
+# LabelIndex), and the tree is stored as an array of parent ids (-1 for the
+# root), so there's no object per body. The depth of every body (the number of
+# direct and indirect orbits it's in) is computed once, up front.
+#
+# To find the distance between two bodies we need their lowest common ancestor
+# (LCA), which we find with "binary lifting": up[k][v] is the 2^k-th ancestor
+# of v, so we can jump up the tree in O(log n) steps instead of one body at a
+# time. The table is only built the first time it's needed, since it takes
+# O(n log n) memory.
+class OrbitTree:
+    def __init__(self, index, parent):
+        self.index = index
+        self.parent = np.asarray(parent, dtype=np.int64)
+        self.first_child, self.next_sibling = self._build_child_lists()
+        self.depth = self._compute_depths()
+        self.up = None
 
-        # We're not done yet.
-        def append_if_not_visted(n, l):
-            if not n.label in visited:
-                q.append((n.label, l, path + [n.label]))
+    # Builds the tree from arrays of labels (dtype "S"), alternating parent,
+    # child.
+    @staticmethod
+    def from_label_arrays(label_arrays):
+        index, ids = LabelIndex.build(label_arrays)
+        parent = np.full(len(index), -1, dtype=np.int64)
+        children = ids[1::2]
+        parent[children] = ids[0::2]
+        if not np.array_equal(parent[children], ids[0::2]):
+            raise ValueError("A body orbits more than one other body!")
+        return OrbitTree(index, parent)
 
-        b = g[label]
-        if b.parent:
-            append_if_not_visted(b.parent, l + 1)
-        for c in b.children:
-            append_if_not_visted(c, l + 1)
+    @staticmethod
+    def from_lines(lines):
+        return OrbitTree.from_label_arrays(
+            [OrbitTree._split_labels("\n".join(lines).encode("ascii"))])
+
+    # Loads an orbit map from a file in one pass, chunk_size bytes at a time.
+    # Only the labels (as a compact "S" array per chunk) are kept in memory.
+    @staticmethod
+    def from_file(path, chunk_size=1 << 24):
+        label_arrays = []
+        with open(path, "rb") as f:
+            tail = b""
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                # Keep any partial line for the next chunk.
+                chunk = tail + chunk
+                end = chunk.rfind(b"\n") + 1
+                tail = chunk[end:]
+                label_arrays.append(OrbitTree._split_labels(chunk[:end]))
+            label_arrays.append(OrbitTree._split_labels(tail))
+        return OrbitTree.from_label_arrays(label_arrays)
+
+    # Turning every ")" into a newline means one split() gives us all the
+    # labels in the data, alternating parent, child.
+    @staticmethod
+    def _split_labels(data):
+        labels = data.replace(b")", b"\n").split()
+        if len(labels) % 2:
+            raise ValueError("Orbit map has a line without a ')'!")
+        return np.array(labels, dtype="S")
+
+    # Builds the children of each body as linked lists: first_child[v] is one
+    # of v's children, and next_sibling[c] is the next child of c's parent (-1
+    # ends the list). Sorting the bodies by parent puts siblings next to each
+    # other, so this is all array operations.
+    def _build_child_lists(self):
+        n = len(self.parent)
+        first_child = np.full(n, -1, dtype=np.int64)
+        next_sibling = np.full(n, -1, dtype=np.int64)
+        c = np.flatnonzero(self.parent >= 0)
+        c = c[np.argsort(self.parent[c])]
+        p = self.parent[c]
+        same = p[1:] == p[:-1]
+        next_sibling[c[:-1][same]] = c[1:][same]
+        starts = np.concatenate(([len(c) > 0], ~same))
+        first_child[p[starts[:len(c)]]] = c[starts[:len(c)]]
+        return first_child, next_sibling
+
+    def children(self, label):
+        c = self.first_child[self.index.id(label)]
+        while c >= 0:
+            yield self.index.label(c)
+            c = self.next_sibling[c]
+
+    # Computes the depth of every body by "pointer jumping": each body keeps
+    # track of an ancestor and its distance to it, and on each round replaces
+    # the ancestor with the ancestor's ancestor (adding the distances). After
+    # O(log depth) rounds every body has reached the root, and its distance is
+    # its depth. Each round is a few array operations over the bodies still
+    # jumping, so there's no recursion, and no Python loop per body.
+    def _compute_depths(self):
+        ancestor = self.parent.copy()
+        depth = (ancestor >= 0).astype(np.int64)
+        active = np.flatnonzero(ancestor >= 0)
+        while len(active):
+            a = ancestor[active]
+            depth[active] += depth[a]
+            ancestor[active] = ancestor[a]
+            active = active[ancestor[active] >= 0]
+        return depth
+
+    def _build_lifting_table(self):
+        n = len(self.parent)
+        # The root is its own parent, so jumping past it is harmless.
+        up0 = np.where(self.parent < 0, np.arange(n), self.parent)
+        levels = max(1, int(self.depth.max()).bit_length())
+        self.up = np.empty((levels, n), dtype=np.int64)
+        self.up[0] = up0
+        for k in range(1, levels):
+            self.up[k] = self.up[k - 1][self.up[k - 1]]
+
+    # The total number of direct and indirect orbits (part 1).
+    def total_orbits(self):
+        return int(self.depth.sum())
+
+    # Returns the label of the lowest common ancestor of two bodies.
+    def lca(self, a_label, b_label):
+        if self.up is None:
+            self._build_lifting_table()
+        u = self.index.id(a_label)
+        v = self.index.id(b_label)
+        if self.depth[u] < self.depth[v]:
+            u, v = v, u
+
+        # Jump u up to the same depth as v.
+        diff = int(self.depth[u] - self.depth[v])
+        k = 0
+        while diff:
+            if diff & 1:
+                u = self.up[k][u]
+            diff >>= 1
+            k += 1
+        if u == v:
+            return self.index.label(u)
+
+        # Jump both up as far as we can without meeting; then the LCA is one
+        # step above.
+        for k in reversed(range(len(self.up))):
+            if self.up[k][u] != self.up[k][v]:
+                u = self.up[k][u]
+                v = self.up[k][v]
+        if self.up[0][u] != self.up[0][v]:
+            raise ValueError(f"{a_label} and {b_label} aren't in the same tree!")
+        return self.index.label(self.up[0][u])
+
+    # The number of orbits between two bodies (the length of the path between
+    # them in the tree).
+    def distance(self, a_label, b_label):
+        a = self.index.id(a_label)
+        b = self.index.id(b_label)
+        c = self.index.id(self.lca(a_label, b_label))
+        return int(self.depth[a] + self.depth[b] - 2 * self.depth[c])
+
+    # The number of orbital transfers needed to get from the body a is orbiting
+    # to the body b is orbiting (part 2).
+    def transfers(self, a_label, b_label):
+        a = self.parent[self.index.id(a_label)]
+        b = self.parent[self.index.id(b_label)]
+        for label, p in [(a_label, a), (b_label, b)]:
+            if p < 0:
+                raise ValueError(f"{label} isn't orbiting anything!")
+        return self.distance(self.index.label(a), self.index.label(b))
+
+def orbit_tree_test():
+    example = [
+        "COM)B", "B)C", "C)D", "D)E", "E)F", "B)G", "G)H", "D)I", "E)J",
+        "J)K", "K)L", "K)YOU", "I)SAN",
+    ]
+    tree = OrbitTree.from_lines(example)
+    # The example has 42 orbits before YOU (depth 7) and SAN (depth 5) are
+    # added.
+    assert(tree.total_orbits() == 42 + 7 + 5)
+    assert(tree.lca("YOU", "SAN") == "D")
+    assert(tree.lca("H", "L") == "B")
+    assert(tree.lca("E", "L") == "E")
+    assert(tree.transfers("YOU", "SAN") == 4)
+    assert(sorted(tree.children("B")) == ["C", "G"])
+    try:
+        tree.transfers("COM", "SAN")
+        assert(False)
+    except ValueError:
+        pass
+
+    # The streaming loader should build the same tree, even if chunks end
+    # part way through a line.
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "orbits")
+        with open(path, "w") as f:
+            f.write("\n".join(example))
+        streamed = OrbitTree.from_file(path, chunk_size=7)
+    assert(np.array_equal(streamed.index.keys, tree.index.keys))
+    assert(np.array_equal(streamed.parent, tree.parent))
+    assert(np.array_equal(streamed.depth, tree.depth))
+
+# Writes a random orbit map with n orbits (a random tree; each body orbits one
+# of the bodies before it) to path. Bodies are named by their number in hex,
+# so the labels stay short like the real ones.
+def write_synthetic_map(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    # Body 0 is COM; body i > 0 orbits a random body in [0, i).
+    parent = (rng.random(n) * np.arange(1, n + 1)).astype(np.int64)
+    with open(path, "w") as f:
+        for i in range(0, n, 1 << 20):
+            j = min(n, i + (1 << 20))
+            f.write("".join(
+                f"{p:X}){c:X}\n"
+                for p, c in zip(parent[i:j].tolist(), range(i + 1, j + 1))))
+
+# Times loading a big synthetic orbit map.
+def benchmark_orbit_map(n=10_000_000):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "orbits")
+        write_synthetic_map(path, n)
+        t0 = time.perf_counter()
+        tree = OrbitTree.from_file(path)
+        elapsed = time.perf_counter() - t0
+    print(f"Loaded {n} orbits in {elapsed:0.2f} s; {tree.total_orbits()} "
+          f"total orbits, max depth {tree.depth.max()}.")
+
+if __name__ == '__main__':
+    orbit_tree_test()
+
+    tree = OrbitTree.from_file("input")
+
+    # Part 1
+    #
+    # We need to get the total number of direct and indirect orbits in the map,
+    # which is just the sum of the depths of all the bodies in the tree.
+    print(f"Got {tree.total_orbits()} total orbits.")
+
+    # Part 2
+    #
+    # Now we need to figure out the minimum number of orbital transfers needed
+    # to get from the body we are currently orbiting (we are represented by
+    # the node YOU) to the body Santa is currently orbiting (SAN). Since the
+    # orbits form a tree, the only path between them goes through their lowest
+    # common ancestor.
+    print(f"Min path from YOU to SAN has length {tree.transfers('YOU', 'SAN')}, "
+          f"via {tree.lca('YOU', 'SAN')}.")
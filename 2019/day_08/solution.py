@@ -1,58 +1,148 @@
-if __name__ == '__main__':
-    with open("input") as f:
-        img_pixels = list(f.readline().rstrip())
+import argparse
+import numpy as np
+import os
+import tempfile
+
+BLACK = 0
+WHITE = 1
+TRANSPARENT = 2
+
+# Reads a Space Image Format image: a stream of digits, one per pixel, with the
+# layers one after another. Returns an array of shape (layers, height, width).
+def read_layers(data, width, height):
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    digits = np.frombuffer(data.strip(), dtype=np.uint8) - ord('0')
+    if digits.size % (width * height):
+        raise ValueError(f"Image has {digits.size} pixels, which isn't a "
+                         f"whole number of {width}x{height} layers!")
+    if np.any(digits > 9):
+        raise ValueError("Image contains something other than digits!")
+    return digits.reshape(-1, height, width)
+
+# Returns an array of shape (layers, 10) with the number of each digit in each
+# layer. Offsetting each layer's digits by 10 * layer index means a single
+# bincount counts every layer at once.
+def count_digits(layers):
+    n = len(layers)
+    offsets = np.arange(n, dtype=np.int64)[:, None] * 10
+    flat = layers.reshape(n, -1) + offsets
+    return np.bincount(flat.ravel(), minlength=n * 10).reshape(n, 10)
+
+# Finds the layer with the fewest 0s, and returns its index and the number of
+# 1s multiplied by the number of 2s in it (part 1).
+def checksum(layers):
+    counts = count_digits(layers)
+    best_index = int(np.argmin(counts[:, 0]))
+    return best_index, int(counts[best_index, 1] * counts[best_index, 2])
+
+# Composites the layers: each pixel takes the value of the first layer where
+# it isn't transparent. argmax finds the first True along the layer axis;
+# pixels which are transparent in every layer stay transparent.
+def decode(layers):
+    opaque = layers != TRANSPARENT
+    first = np.argmax(opaque, axis=0)
+    image = np.take_along_axis(layers, first[None], axis=0)[0]
+    return np.where(opaque.any(axis=0), image, TRANSPARENT)
+
+# Decodes an image straight from a file, without loading the whole thing. The
+# file is memory-mapped, and layers are composited front to back, a chunk of
+# layers (about chunk_bytes) at a time. All we keep between chunks is the
+# image so far and a mask of which pixels are still transparent, and we stop as
+# soon as every pixel has been resolved, so usually only the first few layers
+# are ever read. Returns the image, and the number of layers read.
+def decode_file(path, width, height, chunk_bytes=1 << 24):
+    frame = width * height
+    size = os.path.getsize(path)
+    if size < frame:
+        raise ValueError(f"Image is smaller than one {width}x{height} layer!")
+    pixels = np.memmap(path, dtype=np.uint8, mode="r")
+    # Anything after the last whole layer should be a trailing newline.
+    layer_count = size // frame
+    if pixels[layer_count * frame:].tobytes().strip():
+        raise ValueError(f"Image isn't a whole number of {width}x{height} "
+                         "layers!")
 
+    image = np.full((height, width), TRANSPARENT, dtype=np.uint8)
+    transparent = np.ones((height, width), dtype=bool)
+    chunk_layers = max(1, chunk_bytes // frame)
+    layers_read = 0
+    while layers_read < layer_count and transparent.any():
+        end = min(layer_count, layers_read + chunk_layers)
+        chunk = pixels[layers_read * frame:end * frame] - ord('0')
+        chunk = chunk.reshape(-1, height, width)
+        if np.any(chunk > 9):
+            raise ValueError("Image contains something other than digits!")
+        # Same as decode(), for just this chunk, and then only filling in
+        # the pixels that are still transparent.
+        opaque = chunk != TRANSPARENT
+        first = np.argmax(opaque, axis=0)
+        values = np.take_along_axis(chunk, first[None], axis=0)[0]
+        fill = transparent & opaque.any(axis=0)
+        image[fill] = values[fill]
+        transparent &= ~fill
+        layers_read = end
+    del pixels
+    return image, layers_read
+
+def decode_file_test():
+    rng = np.random.default_rng(0)
+    width, height = 7, 3
+    # Make most pixels transparent, so it takes a while for them all to be
+    # resolved; the last layer is fully opaque.
+    layers = rng.choice([0, 1, 2], p=[0.05, 0.05, 0.9],
+                        size=(200, height, width))
+    layers[-1] = rng.integers(0, 2, size=(height, width))
+    layers = layers.astype(np.uint8)
+    expected = decode(layers)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "image")
+        with open(path, "wb") as f:
+            f.write((layers.ravel() + ord('0')).tobytes() + b"\n")
+        # Chunks which don't line up with the layers, one layer, and
+        # everything at once.
+        for chunk_bytes in [1, 5 * width * height + 3, 1 << 24]:
+            image, layers_read = decode_file(path, width, height, chunk_bytes)
+            assert(np.array_equal(image, expected))
+            assert(layers_read <= len(layers))
+        # With one layer per chunk, we should stop right after the layer where
+        # the last pixel gets resolved.
+        opaque = layers != TRANSPARENT
+        last_needed = int(np.argmax(opaque, axis=0).max())
+        _, layers_read = decode_file(path, width, height, 1)
+        assert(layers_read == last_needed + 1)
+
+def render(image):
+    chars = np.array([' ', '*', ' '])
+    return '\n'.join(''.join(row) for row in chars[image])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
     # Width and height are given as part of problem input.
-    img_width = 25
-    img_height = 6
-    pixels_per_layer = img_width * img_height
-
-    i = 0
-    layers = []
-    while i < len(img_pixels):
-        print(f"Reading layer {len(layers)}, offset is {i}.")
-
-        # Must have enough pixels for another complete layer.
-        assert(i + pixels_per_layer <= len(img_pixels))
-        layers.append(img_pixels[i:i+pixels_per_layer])
-        i += pixels_per_layer
-
-    # We need to find the layer that contains the fewest '0' digits.
-    best_index = None
-    best_count = None
-    for i in range(len(layers)):
-        c = layers[i].count('0')
-
-        print(f"Layer {i} has {c} zeros.")
-
-        if best_count is None or c < best_count:
-            best_index = i
-            best_count = c
-
-    print(f"Layer with fewest zeros is layer {best_index}.")
-
-    # Now get number of '1's multiplied by number of '2's.
-    layer = layers[best_index]
-    print(f"The answer is {layer.count('1') * layer.count('2')}.")
-
-    # Now we need to decode the image. 0 = black, 1 = white, and 2 = transparent.
-    output = []
-    for i in range(pixels_per_layer):
-        p = ' '
-        for layer in layers:
-            v = layer[i]
-            if v == '2':
-                p = ' ' # transparent
-            elif v == '1':
-                p = '*' # white
-                break
-            elif v == '0':
-                p = ' ' # black
-                break
-            else:
-                raise ValueError(f"Unexpected pixel value {v}!")
-        output.append(p)
-    i = 0
-    while i < pixels_per_layer:
-        print(''.join(output[i:i+img_width]))
-        i += img_width
+    parser.add_argument("--width", type=int, default=25)
+    parser.add_argument("--height", type=int, default=6)
+    parser.add_argument("--stream", action="store_true",
+                        help="Only decode the image, streaming it from the file.")
+    parser.add_argument("input_file", type=str, nargs="?", default="input")
+    args = parser.parse_args()
+
+    if args.stream:
+        decode_file_test()
+        image, layers_read = decode_file(args.input_file, args.width,
+                                         args.height)
+        print(f"Decoded image from the first {layers_read} layers.")
+        print(render(image))
+    else:
+        with open(args.input_file, "rb") as f:
+            layers = read_layers(f.read(), args.width, args.height)
+        print(f"Read {len(layers)} layers.")
+
+        # We need to find the layer that contains the fewest '0' digits, then
+        # get number of '1's multiplied by number of '2's.
+        best_index, answer = checksum(layers)
+        print(f"Layer with fewest zeros is layer {best_index}.")
+        print(f"The answer is {answer}.")
+
+        # Now we need to decode the image. 0 = black, 1 = white, and 2 =
+        # transparent.
+        print(render(decode(layers)))
@@ -1,8 +1,12 @@
+import functools
+import itertools
 import math
+import multiprocessing
 import numpy as np
 import time
 
-from collections import defaultdict, namedtuple
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from multiprocessing import shared_memory
 from typing import List
 
 Point = namedtuple("Point", ["x", "y"])
@@ -15,43 +19,37 @@ def point_to_polar(p: Point) -> Polar:
 def polar_to_point(p: Polar) -> Point:
     return Point(x=p.r * math.cos(p.theta), y=p.r * math.sin(p.theta))
 
-def parse_map(lines):
+def quiet(*args, **kwargs):
+    pass
+
+def parse_map(lines, log=print):
     asteroids = []
     y = 0
     for line in lines:
         line = line.rstrip()
-        print(f"Got line: {line}")
+        log(f"Got line: {line}")
         x = 0
         for c in line:
             if c == '#':
-                print(f"Found asteroid at {(x, y)}")
+                log(f"Found asteroid at {(x, y)}")
                 asteroids.append(Point(x, y))
             x += 1
         y += 1
-    print(f"Finished parsing map, x={x}, y={y}")
+    log(f"Finished parsing map, x={x}, y={y}")
     return asteroids, Point(x, y)
 
-def read_map(path):
+def read_map(path, log=print):
     with open(path) as f:
-        return parse_map(f)
+        return parse_map(f, log)
 
 def distance(p0, p1):
     dx = p0.x - p1.x
     dy = p0.y - p1.y
     return math.sqrt(dx**2 + dy**2)
 
-can_see_cache = {}
-
-# TODO: memoize this (the relation is symmetric)
 def can_see(asteroids, a0, a1):
     assert(a0 != a1)
 
-    # Have we already checked this pair?
-    if (a0, a1) in can_see_cache:
-        return can_see_cache[(a0, a1)]
-    elif (a1, a0) in can_see_cache:
-        return can_see_cache[(a1, a0)]
-
     # We can see a1 unless another asteroid lies exactly on the line (a0, a1),
     # and is between a0 and a1:
     #
@@ -83,21 +81,108 @@ def can_see(asteroids, a0, a1):
             # print(f"    {a0} can't see {a1}, blocked by {a2}.")
             ret = False
             break
-
-    # Update cache
-    can_see_cache[(a0, a1)] = ret
     return ret
 
+# Memoizes can_see for one map. The relation is symmetric, so each pair is
+# stored once, under (min(a0, a1), max(a0, a1)). At most capacity pairs are
+# kept; when it's full, the least recently used pair is dropped.
+#
+# For maps that are small enough, precompute() works out the whole relation up
+# front (see direction_keys below) and stores it as a bit matrix, one bit per
+# pair, after which every lookup is a hit.
+class VisibilityCache(object):
+    def __init__(self, asteroids, capacity=1 << 16):
+        self.asteroids = asteroids
+        self.capacity = capacity
+        self.pairs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Set by precompute().
+        self.index = None
+        self.bits = None
+
+    @staticmethod
+    def key(a0, a1):
+        return (a0, a1) if a0 <= a1 else (a1, a0)
+
+    def can_see(self, a0, a1):
+        if self.bits is not None:
+            self.hits += 1
+            i = self.index[a0]
+            j = self.index[a1]
+            return bool((self.bits[i, j >> 3] >> (7 - (j & 7))) & 1)
+
+        key = self.key(a0, a1)
+        try:
+            ret = self.pairs[key]
+            self.pairs.move_to_end(key)
+            self.hits += 1
+            return ret
+        except KeyError:
+            self.misses += 1
+
+        ret = can_see(self.asteroids, a0, a1)
+        self.pairs[key] = ret
+        if len(self.pairs) > self.capacity:
+            self.pairs.popitem(last=False)
+        return ret
+
+    # Computes the visibility of every pair at once, unless the bit matrix
+    # would take more than max_bytes. Returns True if it did. a1 is visible
+    # from a0 if it's the nearest asteroid in its direction from a0, and the
+    # gcd of its offset is exactly how many steps away it is in that direction.
+    def precompute(self, max_bytes=1 << 26, block_size=None):
+        n = len(self.asteroids)
+        if n * ((n + 7) // 8) > max_bytes:
+            return False
+        points = to_array(self.asteroids)
+        span = get_span(points)
+        if block_size is None:
+            block_size = max(1, (1 << 20) // max(n, 1))
+        bits = np.empty((n, (n + 7) // 8), dtype=np.uint8)
+        for i in range(0, n, block_size):
+            stations = points[i:i + block_size]
+            keys, steps = direction_keys(stations, points, span,
+                                         return_steps=True)
+            # Sort each row by direction, then by distance, so the first
+            # asteroid in each run of equal directions is the visible one.
+            order = np.lexsort((steps, keys), axis=-1)
+            keys = np.take_along_axis(keys, order, axis=-1)
+            first = np.ones(keys.shape, dtype=bool)
+            first[:, 1:] = keys[:, 1:] != keys[:, :-1]
+            visible = np.zeros(keys.shape, dtype=bool)
+            np.put_along_axis(visible, order, first, axis=-1)
+            # The station itself is on its own, in "direction" (0, 0).
+            rows = np.arange(len(stations))
+            visible[rows, i + rows] = False
+            bits[i:i + len(stations)] = np.packbits(visible, axis=1)
+        self.index = {a: i for i, a in enumerate(self.asteroids)}
+        self.bits = bits
+        self.pairs.clear()
+        return True
+
+    def count_visible(self, a0):
+        if self.bits is not None:
+            self.hits += len(self.asteroids) - 1
+            row = np.unpackbits(self.bits[self.index[a0]])
+            return int(row[:len(self.asteroids)].sum())
+        return sum(1 for a1 in self.asteroids
+                   if a1 != a0 and self.can_see(a0, a1))
+
 # Get the number of other asteroids visible from the given asteroid. This is the
 # slow (O(n^3)) version (it uses can_see, which considers all other asteroids
-# for each pair (a0, a1)).
-def count_visible_slow(asteroids, a0):
+# for each pair (a0, a1)). Pass a VisibilityCache for the map to reuse pairs
+# between calls.
+def count_visible_slow(asteroids, a0, cache=None):
+    if cache is None:
+        cache = VisibilityCache(asteroids)
+    assert(cache.asteroids is asteroids)
     count = 0
     for a1 in asteroids:
         if a0 == a1:
             # Don't check asteroids against themselves.
             continue
-        elif can_see(asteroids, a0, a1):
+        elif cache.can_see(a0, a1):
             count += 1
     return count
 
@@ -123,6 +208,189 @@ def count_visible_fast(asteroids, a0, epsilon=0.001):
     # Return count of buckets (easy!).
     return len(d)
 
+# Exact versions of the above, which only use integers. An asteroid at offset
+# (dx, dy) from the station is in direction (dx / g, dy / g), where g = gcd(|dx|,
+# |dy|), and two asteroids are on the same line of sight exactly when these
+# reduced directions are equal. So the number of visible asteroids is the
+# number of distinct reduced directions (less one for the station itself, whose
+# offset is (0, 0)). Unlike bucketing by a rounded angle, this never merges two
+# directions that are very close together, however big the map is.
+def to_array(asteroids):
+    return np.array(asteroids, dtype=np.int64).reshape(-1, 2)
+
+# Returns an array of shape (len(stations), len(asteroids)) with a key for the
+# reduced direction from each station to each asteroid. Keys are equal exactly
+# when the directions are. With return_steps, also returns the gcd of each
+# offset, which orders asteroids in the same direction by distance.
+def direction_keys(stations, asteroids, span, return_steps=False):
+    dx = np.subtract(asteroids[None, :, 0], stations[:, None, 0],
+                     dtype=np.int64)
+    dy = np.subtract(asteroids[None, :, 1], stations[:, None, 1],
+                     dtype=np.int64)
+    g = np.gcd(dx, dy)
+    steps = g.copy() if return_steps else None
+    g[g == 0] = 1
+    dx //= g
+    dy //= g
+    # Reduced directions are in [-span, span] on each axis.
+    keys = (dx + span) * (2 * span + 1) + (dy + span)
+    if return_steps:
+        return keys, steps
+    return keys
+
+def get_span(points):
+    if len(points) == 0:
+        return 0
+    return int((points.max(axis=0) - points.min(axis=0)).max())
+
+# Returns the number of asteroids visible from each of points[start:end], as
+# an array. The stations are done in blocks of block_size, so we only need
+# O(block_size * n) memory rather than O(n^2).
+def count_visible_range(points, start, end, span, block_size=None):
+    n = len(points)
+    if block_size is None:
+        block_size = max(1, (1 << 22) // max(n, 1))
+    counts = np.empty(end - start, dtype=np.int64)
+    for i in range(start, end, block_size):
+        j = min(end, i + block_size)
+        keys = direction_keys(points[i:j], points, span)
+        keys.sort(axis=1)
+        distinct = 1 + np.count_nonzero(keys[:, 1:] != keys[:, :-1], axis=1)
+        counts[i - start:j - start] = distinct - 1
+    return counts
+
+# Returns the number of asteroids visible from each asteroid, as an array.
+def count_visible_all(asteroids, block_size=None):
+    points = to_array(asteroids)
+    return count_visible_range(points, 0, len(points), get_span(points),
+                               block_size)
+
+# Same interface as the other count_visible functions.
+def count_visible_exact(asteroids, a0):
+    points = to_array(asteroids)
+    keys = direction_keys(to_array([a0]), points, get_span(points))
+    return len(np.unique(keys)) - (1 if a0 in asteroids else 0)
+
+# Returns the best location for the monitoring station, and the number of
+# asteroids visible from it.
+def best_station(asteroids):
+    counts = count_visible_all(asteroids)
+    i = int(np.argmax(counts))
+    return asteroids[i], int(counts[i])
+
+# Scores the candidate stations [start, end) in a worker process, reading the
+# asteroids from shared memory. Returns the index of the best of them (the
+# first, if there's a tie) and its count.
+def score_stations(shm_name, n, start, end, span):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    points = np.ndarray((n, 2), dtype=np.int32, buffer=shm.buf)
+    try:
+        counts = count_visible_range(points, start, end, span)
+        i = int(np.argmax(counts))
+        return start + i, int(counts[i])
+    finally:
+        del points
+        shm.close()
+
+# Same as best_station, but the candidate stations are split into blocks which
+# are scored by a pool of worker processes. The asteroids are copied into
+# shared memory once (as int32), rather than being sent to every worker.
+def best_station_parallel(asteroids, processes=None, blocks_per_process=4):
+    points = to_array(asteroids)
+    n = len(points)
+    span = get_span(points)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    block = max(1, -(-n // (processes * blocks_per_process)))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, n * 2 * 4))
+    try:
+        shared = np.ndarray((n, 2), dtype=np.int32, buffer=shm.buf)
+        shared[:] = points
+        del shared
+        jobs = [(shm.name, n, i, min(n, i + block), span)
+                for i in range(0, n, block)]
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(score_stations, jobs)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # Highest count wins; on a tie, the lowest index, like np.argmax.
+    i, count = max(results, key=lambda r: (r[1], -r[0]))
+    return asteroids[i], count
+
+# Makes a random map with about n asteroids, with a density of about 1 in 3.
+def make_synthetic_map(n, seed=0):
+    rng = np.random.default_rng(seed)
+    size = int(math.sqrt(3 * n)) + 1
+    points = np.unique(rng.integers(0, size, size=(n, 2)), axis=0)
+    return [Point(int(x), int(y)) for x, y in points]
+
+def benchmark_best_station(n=100_000, processes=None):
+    asteroids = make_synthetic_map(n)
+    results = []
+    for name, fn in [
+            ("serial", best_station),
+            ("parallel", lambda a: best_station_parallel(a, processes))]:
+        t0 = time.perf_counter()
+        results.append(fn(asteroids))
+        elapsed = time.perf_counter() - t0
+        print(f"{name}: best station for {len(asteroids)} asteroids is "
+              f"{results[-1]}, found in {elapsed:0.2f} s.")
+    assert(results[0] == results[1])
+
+def count_visible_test():
+    # The best station for each test map, and how many asteroids it can see.
+    tests = [
+        ("example", Point(3, 4), 8),
+        ("test_0", Point(5, 8), 33),
+        ("test_1", Point(1, 2), 35),
+        ("test_2", Point(6, 3), 41),
+        ("test_3", Point(11, 13), 210),
+    ]
+    for path, station, visible in tests:
+        asteroids, _ = read_map(path, log=quiet)
+        assert(best_station(asteroids) == (station, visible))
+        assert(best_station_parallel(asteroids, processes=2) ==
+               (station, visible))
+        counts = count_visible_all(asteroids, block_size=7)
+        if len(asteroids) < 100:
+            cache = VisibilityCache(asteroids)
+            for a0, count in zip(asteroids, counts):
+                assert(count == count_visible_slow(asteroids, a0, cache))
+                assert(count == count_visible_exact(asteroids, a0))
+            # Every pair was computed once, and found again from the other
+            # end.
+            pairs = len(asteroids) * (len(asteroids) - 1) // 2
+            assert(cache.misses == pairs and cache.hits == pairs)
+
+            # A tiny cache gives the same answers.
+            small = VisibilityCache(asteroids, capacity=3)
+            for a0, count in zip(asteroids, counts):
+                assert(count == count_visible_slow(asteroids, a0, small))
+            assert(len(small.pairs) == 3)
+
+            for a0 in asteroids:
+                for a1 in asteroids:
+                    if a0 != a1:
+                        assert(small.can_see(a0, a1) == cache.can_see(a0, a1))
+
+        # The bit matrix should agree with the exact counts.
+        cache = VisibilityCache(asteroids)
+        assert(cache.precompute(block_size=5))
+        for a0, count in zip(asteroids, counts):
+            assert(cache.count_visible(a0) == count)
+        assert(not VisibilityCache(asteroids).precompute(max_bytes=10))
+
+    # These directions differ by less than the epsilon used by
+    # count_visible_fast, but they're still different lines of sight. The last
+    # asteroid is hidden behind the second.
+    asteroids = [Point(0, 0), Point(1000, 1001), Point(999, 1000),
+                 Point(2000, 2002)]
+    assert(count_visible_exact(asteroids, Point(0, 0)) == 2)
+    assert(list(count_visible_all(asteroids)) == [2, 3, 3, 2])
+
 # This version does no work. The result is not correct (for obvious reasons) but
 # it's useful for benchmarking since it's the fastest possible "solution".
 def count_visible_zero(asteroids, a0):
@@ -134,7 +402,7 @@ def count_visible_zero(asteroids, a0):
 # as origin; keep closest asteroid for each angle; count them). Note that
 # since we memoized the can_see method the speedup might not be that big
 # in practice.
-def solve_part1(asteroids: List[Point], count_visible_fn=count_visible_slow) -> Point:
+def solve_part1(asteroids: List[Point], count_visible_fn=None) -> Point:
     # In this problem, we are given a (2d) grid, each cell of which may be empty
     # ('.') or which may contain an asteroid ('#'). We need to find the asteroid
     # from which we can see the most other asteroids (asteroids block line of
@@ -144,6 +412,12 @@ def solve_part1(asteroids: List[Point], count_visible_fn=count_visible_slow) ->
     # other asteroids in the grid, counting each as visible if no third asteroid
     # lies between it and the start point. This is not terribly efficient, but
     # it's a good place to start from since it is obviously correct.
+    cache = None
+    if count_visible_fn is None:
+        cache = VisibilityCache(asteroids)
+        count_visible_fn = lambda asteroids, a0: count_visible_slow(
+            asteroids, a0, cache)
+
     best_asteroid = None
     max_seen = 0
     i = 0
@@ -169,6 +443,8 @@ def solve_part1(asteroids: List[Point], count_visible_fn=count_visible_slow) ->
     elapsed = time.perf_counter() - t0
     a_per_s = float(i) / float(elapsed)
     print(f"Checked {i} asteroids in {elapsed:0.2f} s ({a_per_s:0.2f} asteroids / s).")
+    if cache:
+        print(f"Visibility cache had {cache.hits} hits and {cache.misses} misses.")
     print(f"Best asteroid is {best_asteroid.x, best_asteroid.y} with {max_seen} other asteroids visible.")
     return best_asteroid
 
@@ -188,112 +464,75 @@ def draw_vaporized_map(vaporized, origin, rows, cols):
         print(''.join(r))
     print()
 
+# Orders directions (dx, dy) by angle, clockwise from "up". Since +y points
+# down the page, "up" is -y, and clockwise is towards +x. Directions in the
+# right half (including straight up) come before those in the left half
+# (including straight down); within a half, a comes before b if turning from a
+# to b is clockwise, i.e. the cross product is positive. Everything's an
+# integer, so there's no rounding.
+def compare_directions(a, b):
+    def half(d):
+        return 0 if d[0] > 0 or (d[0] == 0 and d[1] < 0) else 1
+
+    if half(a) != half(b):
+        return half(a) - half(b)
+    cross = a[0] * b[1] - a[1] * b[0]
+    return -1 if cross > 0 else (1 if cross < 0 else 0)
+
+# Generates the asteroids in the order the giant laser at origin vaporizes
+# them. Asteroids are bucketed by their gcd-reduced direction from the origin,
+# and each bucket is a deque ordered by distance. The buckets are sorted by
+# angle once, and then kept in a deque of their own: each time the laser
+# reaches a bucket it vaporizes the nearest asteroid, and the bucket goes to
+# the back of the queue if it has any left. This is O(n log n) overall, and
+# since it's a generator, callers that only want the first few asteroids stop
+# early.
+def vaporization_order(asteroids, origin):
+    buckets = defaultdict(list)
+    for a in asteroids:
+        if a == origin:
+            # This is the location of the monitoring station.
+            continue
+        dx = a.x - origin.x
+        dy = a.y - origin.y
+        g = math.gcd(dx, dy)
+        buckets[(dx // g, dy // g)].append((g, a))
+
+    directions = sorted(buckets, key=functools.cmp_to_key(compare_directions))
+    queue = deque(deque(a for _, a in sorted(buckets[d])) for d in directions)
+    while queue:
+        bucket = queue.popleft()
+        yield bucket.popleft()
+        if bucket:
+            queue.append(bucket)
+
+# Returns the nth (counting from 1) asteroid to be vaporized.
+def nth_vaporized(asteroids, origin, n):
+    return next(itertools.islice(vaporization_order(asteroids, origin),
+                                 n - 1, None))
+
+def vaporization_test():
+    asteroids, _ = read_map("test_3", log=quiet)
+    origin = Point(11, 13)
+    tests = [
+        (1, Point(11, 12)), (2, Point(12, 1)), (3, Point(12, 2)),
+        (10, Point(12, 8)), (20, Point(16, 0)), (50, Point(16, 9)),
+        (100, Point(10, 16)), (199, Point(9, 6)), (200, Point(8, 2)),
+        (201, Point(10, 9)), (299, Point(11, 1)),
+    ]
+    for n, expected in tests:
+        assert(nth_vaporized(asteroids, origin, n) == expected)
+    assert(len(list(vaporization_order(asteroids, origin))) == 299)
+
 # Asteroids is the parsed asteroid map. Origin is the location of the monitoring
-# station. This method will remove the asteroid at the origin, if needed. Bounds
-# are the bounds to use when printing the maps showing the order in which the
-# asteroids are destroyed.
+# station. Bounds are the bounds to use when printing the maps showing the
+# order in which the asteroids are destroyed.
 def solve_part2(asteroids, origin, bounds):
     # In part 2, the elves use a giant laser to vaporize the asteroids. The
     # laser starts at an angle of 0 deg from the vertical (i.e. pointing up) and
     # sweeps clockwise, vaporizing any asteroids it hits. We need to compute the
-    # order in which the asteroids will be vaporized. To do that, we tranform
-    # to radial coordinates and sort by distance. Easy.
-    #
-    # Angles that differ by less than this value are considered equal (ie. the
-    # associated asteroids are considered to be on the same line from the
-    # origin).
-    epsilon = 0.001
-
-    def transform(a: Point):
-        # translate to new origin
-        x = a.x - origin.x
-        y = a.y - origin.y
-
-        # rotate 90 deg CW
-        new_x = y
-        new_y = -x
-        x = new_x
-        y = new_y
-
-        # convert to polar coords
-        r = math.sqrt(x**2 + y**2)
-        theta = math.atan2(y, x)
-        return Polar(r, theta)
-
-    def untransform(a: Polar):
-        # convert to cart coords
-        x = a.r * math.cos(a.theta)
-        y = a.r * math.sin(a.theta)
-
-        # rotate 90 CCW
-        new_x = -y
-        new_y = x
-        x = new_x
-        y = new_y
-
-        # translate to orginal origin
-        x += origin.x
-        y += origin.y
-        return Point(x, y)
-
-    # Remove asteroid at origin if needed -- this is the location of the
-    # monitoring station.
-    asteroids = filter(lambda a: a.x != origin.x or a.y != origin.y, asteroids)
-
-    # Transform to polar coordinates and rotate entire coordinate system by 90
-    # deg CW (see note below).
-    asteroids = [transform(a) for a in asteroids]
-
-    # Turn epsilon into a number of digits (after decimal) to keep.
-    assert(epsilon < 1)
-    ndigits = int(-math.log10(epsilon))
-
-    # Bucket asteroids by angle, then sort all buckets by distance.
-    d = defaultdict(list)
-    for a in asteroids:
-        d[round(a.theta, ndigits)].append(a)
-
-    for k in d.keys():
-        d[k].sort(key=lambda a: a.r)
-
-    # for k, v in sorted(d.items()):
-    #     print(f"{k:0.03f}: {v}")
-
-    # Ok. Now this part is a bit weird, but: our laser starts out pointing "up",
-    # but this actually the -y direction (since in the given examples, +y points
-    # down the page, according to the coordinates assigned to the asteroids).
-    # The laser then rotates "clockwise", but, again, due to the fact that the
-    # y-axis is swapped, the actual sense of the rotation is counterclockwise
-    # (we are pointing "up" along the -y axis, and we rotate _toward_ the +x
-    # axis -- this is counterclockwise).
-    #
-    # We rotated everything 90 deg clockwise earlier so that what was originally
-    # the -y direction is now our -x, and what was originally our +x is now our
-    # -y. So we can simply iterate from -pi to pi and we'll hit the buckets in
-    # the same order as described in the problem statement.
-    vaporized = []
-    while len(vaporized) < len(asteroids):
-        # Still asteroids left. Take the first asteroid from each non-empty
-        # bucket.
-        #
-        # This is to handle the weird edge case where stuff on the (original) -y
-        # axis ends up with a theta of either pi or -pi, but we want to make
-        # sure it's "hit" first since the laser starts out pointing in that
-        # direction.
-        pi_rounded = round(math.pi, ndigits)
-        if d[pi_rounded]:
-            vaporized.append(d[pi_rounded].pop(0))
-        for k, v in sorted(d.items()):
-            if k < 3.142:
-                # print(f"Checking bucket {k}")
-                if v:
-                    vaporized.append(v.pop(0))
-
-    # Convert back to the original coordinate system. Because of numerical error
-    # we end up with coordinates that aren't quite integers; we just round to
-    # the nearest integer to fix this.
-    vaporized = [untransform(a) for a in vaporized]
-    vaporized = [Point(x=round(v.x), y=round(v.y)) for v in vaporized]
+    # order in which the asteroids will be vaporized (see vaporization_order).
+    vaporized = list(vaporization_order(asteroids, origin))
 
     # Print out the order the asteroids were vaporized, and some nice maps, just
     # like in the problem statement.
@@ -322,10 +561,15 @@ def solve_part2(asteroids, origin, bounds):
         vaporized = vaporized[9:]
 
 if __name__ == "__main__":
-    asteroids, bounds = read_map("input")
+    count_visible_test()
+    vaporization_test()
+
+    asteroids, bounds = read_map("input", log=quiet)
 
     # Solve part one to get location of monitoring station.
-    # origin = solve_part1(asteroids, count_visible_fast)
+    origin, max_seen = best_station(asteroids)
+    print(f"Best asteroid is {origin.x, origin.y} with {max_seen} other "
+          "asteroids visible.")
 
     # Now solve part 2.
-    solve_part2(asteroids, origin=Point(x=11, y=19), bounds=bounds)
+    solve_part2(asteroids, origin=origin, bounds=bounds)
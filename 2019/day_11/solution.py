@@ -4,12 +4,17 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
+import argparse
+import contextlib
 import intcode
+import numpy as np
+import time
 
 from collections import defaultdict
 from common import Point
 from copy import deepcopy
 from enum import IntEnum
+from render import PrintBackend, Renderer
 
 class Color(IntEnum):
     BLACK = 0
@@ -33,7 +38,6 @@ class Bounds:
         self.right = max(self.right, p.x)
         self.bottom = min(self.bottom, p.y)
         self.left = min(self.left, p.x)
-        print(f"New bounds are {(self.top, self.right, self.bottom, self.left)}.")
 
 # The "hull".
 class Grid:
@@ -56,15 +60,101 @@ class Grid:
         self.cells[p.y][p.x] = color
         self.bounds.extend(p)
 
+# The "hull", backed by NumPy arrays instead of nested dicts. The arrays start
+# out small and double in size whenever the robot wanders off the edge. We also
+# remember which panels have been painted (see mark_painted), so that we can
+# get the number of panels painted at least once without building a set.
+class ArrayGrid:
+    def __init__(self, size=64):
+        self.colors = np.zeros((size, size), dtype=np.uint8)
+        self.painted = np.zeros((size, size), dtype=bool)
+        # Offset from hull coordinates to array indices.
+        self.offset = Point(size // 2, size // 2)
+        self.bounds = Bounds()
+        self.painted_count = 0
+
+    def get_bounds(self):
+        return self.bounds
+
+    # Returns the array indices for p, growing the arrays if needed.
+    def _index(self, p):
+        rows, cols = self.colors.shape
+        x = p.x + self.offset.x
+        y = p.y + self.offset.y
+        while not (0 <= x < cols and 0 <= y < rows):
+            # Double in both directions, keeping the old contents centered.
+            dy, dx = rows // 2, cols // 2
+            colors = np.zeros((rows * 2, cols * 2), dtype=self.colors.dtype)
+            colors[dy:dy + rows, dx:dx + cols] = self.colors
+            painted = np.zeros((rows * 2, cols * 2), dtype=bool)
+            painted[dy:dy + rows, dx:dx + cols] = self.painted
+            self.colors = colors
+            self.painted = painted
+            self.offset = self.offset.translate(dx, dy)
+            rows, cols = self.colors.shape
+            x += dx
+            y += dy
+        return y, x
+
+    def get_cell(self, p):
+        rows, cols = self.colors.shape
+        x = p.x + self.offset.x
+        y = p.y + self.offset.y
+        if 0 <= x < cols and 0 <= y < rows:
+            return Color(self.colors[y, x])
+        return Color.BLACK
+
+    def set_cell(self, p, color):
+        # Get the index first; it may replace self.colors.
+        i = self._index(p)
+        self.colors[i] = color
+        self.bounds.extend(p)
+
+    # Can be used as the robot's paint_cb.
+    def mark_painted(self, p):
+        i = self._index(p)
+        if not self.painted[i]:
+            self.painted[i] = True
+            self.painted_count += 1
+
+    def get_painted_count(self):
+        return self.painted_count
+
+    # Returns the painted part of the hull as a string ('#' for white, '.' for
+    # black).
+    def render(self, padding=0):
+        b = self.bounds
+        top = b.bottom - padding + self.offset.y
+        left = b.left - padding + self.offset.x
+        rows = b.top - b.bottom + 2 * padding + 1
+        cols = b.right - b.left + 2 * padding + 1
+        # Pad with black in case the padding runs off the edge of the arrays.
+        colors = np.pad(self.colors, rows + cols)
+        top += rows + cols
+        left += rows + cols
+        view = colors[top:top + rows, left:left + cols]
+        chars = np.where(view == Color.WHITE, '#', '.')
+        return '\n'.join(''.join(row) for row in chars)
+
 # Hull painting robot.
 class Robot:
-    def __init__(self, program, grid, pos, facing, paint_cb):
+    # The hull is drawn into renderer as the robot moves; by default it's
+    # printed to stdout at most 30 times a second. In headless mode the robot
+    # doesn't draw or log anything.
+    def __init__(self, program, grid, pos, facing, paint_cb, renderer=None,
+                 headless=False):
         # TODO: intcode machine for "brain"
         self.program = program
         self.grid = grid
         self.pos = pos
         self.facing = facing
         self.paint_cb = paint_cb
+        self.headless = headless
+        if renderer is None and not headless:
+            renderer = Renderer(PrintBackend(padding=2, fill='.'))
+        self.renderer = renderer
+        # Number of times the robot has moved.
+        self.steps = 0
 
     def get_pos(self):
         return self.pos
@@ -81,8 +171,10 @@ class Robot:
         def paint(color):
             # 0 means paint black, 1 means paint white
             self.grid.set_cell(self.pos, Color(color))
+            self.draw_cell(self.pos)
             self.paint_cb(self.pos)
-            print(f"Robot painted cell {self.pos} {str(Color(color))}.")
+            if not self.headless:
+                print(f"Robot painted cell {self.pos} {str(Color(color))}.")
 
         def turn(direction):
             # 0 means 90 deg left, 1 means 90 deg right
@@ -93,7 +185,8 @@ class Robot:
                 Direction.LEFT: (Direction.DOWN, Direction.UP),
             }
             new_facing = rules[self.facing][direction]
-            print(f"Robot turned from {str(self.facing)} to {str(new_facing)}.")
+            if not self.headless:
+                print(f"Robot turned from {str(self.facing)} to {str(new_facing)}.")
             self.facing = new_facing
 
         class OutputState(IntEnum):
@@ -118,7 +211,10 @@ class Robot:
             camera, # input_fn
             output, # output_fn
         )
+        self.draw_grid()
         im.run()
+        if self.renderer:
+            self.renderer.flush(force=True)
 
     def move(self):
         new_pos = None
@@ -133,10 +229,25 @@ class Robot:
             new_pos = Point(self.pos.x - 1, self.pos.y)
         else:
             assert("Unknown direction: {self.facing}")
-        print(f"Robot moved from {self.pos} to {new_pos}.")
+        if not self.headless:
+            print(f"Robot moved from {self.pos} to {new_pos}.")
         self.pos = new_pos
+        self.steps += 1
+
+    def draw_cell(self, p):
+        if not self.renderer:
+            return
+        if self.grid.get_cell(p) == Color.BLACK:
+            self.renderer.set_char(p.x, p.y, '.')
+        else:
+            self.renderer.set_char(p.x, p.y, '#')
 
+    # Draw the robot in its current position. The renderer decides when the
+    # hull actually gets redrawn.
     def draw_grid(self):
+        if not self.renderer:
+            return
+
         def get_char_for_facing(facing):
             if facing == Direction.UP:
                 return '^'
@@ -147,31 +258,66 @@ class Robot:
             if facing == Direction.LEFT:
                 return '<'
 
-        bounds = self.grid.get_bounds()
-        padding = 2
-        y = bounds.bottom - padding
-        while y <= bounds.top + padding:
-            row = []
-            x = bounds.left - padding
-            while x <= bounds.right + padding:
-                if x == self.pos.x and y == self.pos.y:
-                    row.append(get_char_for_facing(self.facing))
-                elif self.grid.get_cell(Point(x, y)) == Color.BLACK:
-                    row.append('.')
-                else:
-                    row.append('#')
-                x += 1
-            print(''.join(row))
-            y += 1
-        print()
+        self.renderer.set_char(
+            self.pos.x, self.pos.y, get_char_for_facing(self.facing))
+        self.renderer.flush()
 # End of Robot class
 
+# Runs the robot in its original mode (dict-backed grid, logging every step,
+# and redrawing the whole hull after every move, with no frame rate limit) and
+# in headless mode, and reports steps / s for both. All output from the
+# original mode is thrown away.
+def benchmark(program):
+    def run(headless):
+        if headless:
+            grid = ArrayGrid()
+            paint_cb = grid.mark_painted
+            renderer = None
+        else:
+            grid = Grid()
+            panels_painted = set()
+            paint_cb = panels_painted.add
+            renderer = Renderer(PrintBackend(padding=2, fill='.'),
+                                max_fps=None)
+        grid.set_cell(Point(0, 0), Color.WHITE)
+        robot = Robot(program, grid, Point(0, 0), Direction.UP, paint_cb,
+                      renderer=renderer, headless=headless)
+        t0 = time.perf_counter()
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                robot.run()
+        return robot.steps, time.perf_counter() - t0
+
+    for label, headless in (("original", False), ("headless", True)):
+        steps, elapsed = run(headless)
+        print(f"{label:>8}: {steps} steps in {elapsed:0.3f} s "
+              f"({steps / elapsed:0.1f} steps / s).")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true",
+                        help="only draw the hull once the robot is done")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare the speed of the normal and headless modes")
+    args = parser.parse_args()
+
     program = intcode.read_initial_memory("input")
-    panels_painted = set()
-    grid = Grid()
-    # In part 2 initial square is white
-    grid.set_cell(Point(0, 0), Color.WHITE)
-    robot = Robot(program, grid, Point(0, 0), Direction.UP, lambda p: panels_painted.add(p))
-    robot.run()
-    print(f"The number of panels painted at least once is: {len(panels_painted)}.")
+    if args.benchmark:
+        benchmark(program)
+    elif args.headless:
+        grid = ArrayGrid()
+        # In part 2 initial square is white
+        grid.set_cell(Point(0, 0), Color.WHITE)
+        robot = Robot(program, grid, Point(0, 0), Direction.UP,
+                      grid.mark_painted, headless=True)
+        robot.run()
+        print(grid.render(padding=2))
+        print(f"The number of panels painted at least once is: {grid.get_painted_count()}.")
+    else:
+        panels_painted = set()
+        grid = Grid()
+        # In part 2 initial square is white
+        grid.set_cell(Point(0, 0), Color.WHITE)
+        robot = Robot(program, grid, Point(0, 0), Direction.UP, lambda p: panels_painted.add(p))
+        robot.run()
+        print(f"The number of panels painted at least once is: {len(panels_painted)}.")
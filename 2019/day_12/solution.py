@@ -1,10 +1,14 @@
+import argparse
 import cProfile
 import datetime
 import io
+import itertools
 import math
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 import pstats
+import tempfile
 import time
 
 from mpl_toolkits.mplot3d import Axes3D
@@ -39,8 +43,10 @@ def call_callbacks(callbacks, step, positions, velocities):
 #
 # positions and velocities are expected to be Mx3 matrices, where M is the number
 # of objects in the simulation.
-def simulate(positions, velocities, max_steps, callbacks=None):
-    step = 0
+#
+# To resume a simulation, pass the number of steps already done as start_step.
+def simulate(positions, velocities, max_steps, callbacks=None, start_step=0):
+    step = start_step
     while step < max_steps:
         if call_callbacks(callbacks, step, positions, velocities):
             break
@@ -51,8 +57,8 @@ def simulate(positions, velocities, max_steps, callbacks=None):
         step += 1
     return (step, positions, velocities)
 
-def simulate2(positions, velocities, max_steps, callbacks=None):
-    step = 0
+def simulate2(positions, velocities, max_steps, callbacks=None, start_step=0):
+    step = start_step
     while step < max_steps:
         if call_callbacks(callbacks, step, positions, velocities):
             break
@@ -62,14 +68,276 @@ def simulate2(positions, velocities, max_steps, callbacks=None):
     return (step, positions, velocities)
 
 # Simulate on one axis. Assumes x, v_x are 1D arrays.
-def simulate_one_axis(x, v_x, max_steps, callbacks=None):
-    for step in range(1, int(max_steps) + 1):
+def simulate_one_axis(x, v_x, max_steps, callbacks=None, start_step=0):
+    step = start_step
+    for step in range(start_step + 1, int(max_steps) + 1):
         v_x += np.sum(np.sign(np.subtract.outer(x, x)), axis=0)
         x += v_x
         if call_callbacks(callbacks, step, x, v_x):
             break
     return (step, x, v_x)
 
+# Periodically saves the state of a simulation, so that it can be resumed
+# later (see load()). Use it as a simulation callback; it saves whenever
+# every_steps steps or every_seconds seconds have passed since the last save
+# (whichever comes first). Each checkpoint is written to a temporary file in
+# the same directory and then renamed over the old one, so a crash part way
+# through a save leaves the previous checkpoint intact.
+#
+# Along with the current state, a checkpoint records the initial state, so we
+# don't resume a different simulation by mistake, and whether the simulation
+# is done (so a finished search doesn't need to be run again).
+class Checkpointer(object):
+    def __init__(self, path, initial_positions, initial_velocities,
+                 every_steps=None, every_seconds=60.0):
+        self.path = path
+        self.initial_positions = initial_positions.copy()
+        self.initial_velocities = initial_velocities.copy()
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.last_step = None
+        self.last_time = time.monotonic()
+
+    def __call__(self, step, positions, velocities):
+        if self.last_step is None:
+            self.last_step = step
+        if ((self.every_steps and step - self.last_step >= self.every_steps) or
+                (self.every_seconds and
+                 time.monotonic() - self.last_time >= self.every_seconds)):
+            self.save(step, positions, velocities)
+        return False  # never stop simulation early
+
+    def save(self, step, positions, velocities, done=False):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, step=np.int64(step), done=np.bool_(done),
+                         positions=positions, velocities=velocities,
+                         initial_positions=self.initial_positions,
+                         initial_velocities=self.initial_velocities)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.last_step = step
+        self.last_time = time.monotonic()
+
+    # Returns (step, positions, velocities, done) from the checkpoint at path,
+    # or None if there isn't one, or it's from a simulation with a different
+    # initial state.
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as checkpoint:
+            if not (np.array_equal(checkpoint["initial_positions"],
+                                   self.initial_positions) and
+                    np.array_equal(checkpoint["initial_velocities"],
+                                   self.initial_velocities)):
+                return None
+            step = int(checkpoint["step"])
+            done = bool(checkpoint["done"])
+            positions = checkpoint["positions"].astype(
+                self.initial_positions.dtype)
+            velocities = checkpoint["velocities"].astype(
+                self.initial_velocities.dtype)
+        self.last_step = step
+        return step, positions, velocities, done
+
+# Simulates many independent systems at once. positions and velocities are
+# arrays of shape (systems, moons, axes), and every system is advanced together
+# in each step, with no callbacks, so the per-step Python overhead is shared by
+# all of them. Since the axes don't interact, the three axes of one system can
+# also be simulated as three systems with one axis each (see
+# axes_as_systems()).
+#
+# Internally the state is rearranged to (moons, systems, axes), so each moon's
+# state is one contiguous block, and gravity is applied a pair of moons at a
+# time: the pull on i from j is exactly the opposite of the pull on j from i,
+# so each sign only needs to be computed once. The arrays are updated in place
+# (and also returned).
+def simulate_batch(positions, velocities, steps):
+    moons = positions.shape[1]
+    p = np.ascontiguousarray(positions.transpose(1, 0, 2))
+    v = np.ascontiguousarray(velocities.transpose(1, 0, 2))
+    pull = np.empty_like(p[0])
+    pairs = list(itertools.combinations(range(moons), 2))
+    for _ in range(int(steps)):
+        for i, j in pairs:
+            np.subtract(p[j], p[i], out=pull)
+            np.sign(pull, out=pull)
+            v[i] += pull
+            v[j] -= pull
+        p += v
+    positions[...] = p.transpose(1, 0, 2)
+    velocities[...] = v.transpose(1, 0, 2)
+    return positions, velocities
+
+# Returns the total energy of each system in a batch.
+def total_energy(positions, velocities):
+    potential = np.abs(positions).sum(axis=2)
+    kinetic = np.abs(velocities).sum(axis=2)
+    return (potential * kinetic).sum(axis=1)
+
+# Turns the (moons, axes) positions of one system into a batch of one system
+# per axis, of shape (axes, moons, 1).
+def axes_as_systems(positions):
+    return np.ascontiguousarray(positions.T[:, :, None])
+
+def random_systems(systems, moons=4, axes=3, seed=0, dtype=np.int64):
+    rng = np.random.default_rng(seed)
+    positions = rng.integers(-20, 21, size=(systems, moons, axes)).astype(dtype)
+    return positions, np.zeros_like(positions)
+
+def simulate_batch_test():
+    # The two examples from the problem, with their total energy after 10 and
+    # 100 steps.
+    example0 = np.array([[-1, 0, 2], [2, -10, -7], [4, -8, 8], [3, 5, -1]])
+    example1 = np.array([[-8, -10, 0], [5, 5, 10], [2, -7, 3], [9, -8, -3]])
+    positions = np.stack([example0, example1]).astype(np.int64)
+    velocities = np.zeros_like(positions)
+    simulate_batch(positions, velocities, 10)
+    assert(total_energy(positions, velocities)[0] == 179)
+    simulate_batch(positions, velocities, 90)
+    assert(total_energy(positions, velocities)[1] == 1940)
+
+    # A batch should match simulating each system on its own, and so should
+    # simulating each axis as its own system.
+    positions, velocities = random_systems(5)
+    p_axes = np.concatenate([axes_as_systems(p) for p in positions])
+    v_axes = np.zeros_like(p_axes)
+    expected = [simulate2(p.copy(), v.copy(), 50, [])[1:]
+                for p, v in zip(positions, velocities)]
+    simulate_batch(positions, velocities, 50)
+    simulate_batch(p_axes, v_axes, 50)
+    for i, (p, v) in enumerate(expected):
+        assert(np.array_equal(positions[i], p))
+        assert(np.array_equal(velocities[i], v))
+        assert(np.array_equal(p_axes[3 * i:3 * i + 3, :, 0], p.T))
+        assert(np.array_equal(v_axes[3 * i:3 * i + 3, :, 0], v.T))
+
+# Compares the moon-steps per second of simulate2 (one system, with callbacks)
+# and simulate_batch.
+def benchmark_batch(systems=4096, steps=1000):
+    positions, velocities = random_systems(1)
+    t0 = time.perf_counter()
+    simulate2(positions[0], velocities[0], steps, [])
+    rate = steps * positions.shape[1] / (time.perf_counter() - t0)
+    print(f"simulate2: {rate:0.0f} moon-steps / s.")
+
+    positions, velocities = random_systems(systems)
+    t0 = time.perf_counter()
+    simulate_batch(positions, velocities, steps)
+    rate = steps * systems * positions.shape[1] / (time.perf_counter() - t0)
+    print(f"simulate_batch ({systems} systems): {rate:0.0f} moon-steps / s.")
+
+# Returns the smallest of int16, int32 and int64 (but no smaller than
+# current) that can hold every position and velocity for the next steps steps,
+# and the difference between any two positions (see find_axis_periods). Each
+# step changes a velocity by at most moons - 1, and a position by at most the
+# (new) velocity.
+def overflow_safe_dtype(positions, velocities, steps, moons, current=np.int16):
+    max_v = int(np.abs(velocities).max(initial=0)) + steps * (moons - 1)
+    max_p = int(np.abs(positions).max(initial=0)) + steps * max_v
+    bound = max(max_v, 2 * max_p)
+    for dtype in (np.int16, np.int32, np.int64):
+        if (np.dtype(dtype).itemsize >= np.dtype(current).itemsize and
+                bound <= np.iinfo(dtype).max):
+            return dtype
+    raise OverflowError(f"Can't simulate {steps} more steps without overflow!")
+
+# Finds the period of each axis of one system (positions is a moons x axes
+# array). Returns a list with the period of each axis, or None for any axis
+# that didn't repeat within max_steps.
+#
+# The system is reversible (we can always work out the previous state from the
+# current one), so the first state to repeat is always the initial one. And if
+# the velocities start out at zero (as in the puzzle), the motion is symmetric
+# in time about every point where the velocities are all zero: if they're first
+# all zero again after t steps, then the state after 2t steps is the initial
+# one. The period is t if the positions are back where they started too, and
+# 2t otherwise, so we only need to simulate half the period.
+#
+# All the axes are simulated together, block_size steps at a time, with the
+# velocities and positions after each step saved into a buffer. The check for
+# a repeat is done on the whole block at once, rather than after every step.
+def find_axis_periods(positions, velocities=None, block_size=1024,
+                      max_steps=None):
+    positions = np.asarray(positions)
+    moons, axes = positions.shape
+    if velocities is None:
+        velocities = np.zeros_like(positions)
+    p0 = positions.T.astype(np.int64)
+    v0 = np.asarray(velocities).T.astype(np.int64)
+    reversible = not v0.any()
+
+    periods = [None] * axes
+    dtype = np.int16
+    p = v = None
+    step = 0
+    while None in periods and (max_steps is None or step < max_steps):
+        k = block_size if max_steps is None else min(block_size,
+                                                     int(max_steps) - step)
+        dtype = overflow_safe_dtype(p0 if p is None else p,
+                                    v0 if v is None else v, k, moons, dtype)
+        if p is None or p.dtype != dtype:
+            p = (p0 if p is None else p).astype(dtype)
+            v = (v0 if v is None else v).astype(dtype)
+            delta = np.empty((axes, moons, moons), dtype=dtype)
+            gravity = np.empty((axes, moons), dtype=dtype)
+            p_history = np.empty((block_size, axes, moons), dtype=dtype)
+            v_history = np.empty((block_size, axes, moons), dtype=dtype)
+
+        for i in range(k):
+            # delta[a, i, j] = p[a, j] - p[a, i]; summing the signs over j
+            # gives the gravity on moon i.
+            np.subtract(p[:, None, :], p[:, :, None], out=delta)
+            np.sign(delta, out=delta)
+            np.sum(delta, axis=2, out=gravity)
+            v += gravity
+            p += v
+            p_history[i] = p
+            v_history[i] = v
+
+        at_start = (p_history[:k] == p0).all(axis=2)
+        if reversible:
+            stopped = ~v_history[:k].any(axis=2)
+        else:
+            stopped = at_start & (v_history[:k] == v0).all(axis=2)
+        for a in range(axes):
+            if periods[a] is None and stopped[:, a].any():
+                i = int(np.argmax(stopped[:, a]))
+                t = step + i + 1
+                periods[a] = t if at_start[i, a] or not reversible else 2 * t
+        step += k
+    return periods
+
+# Returns the period of the whole system (the lcm of the periods of the axes),
+# or None if some axis didn't repeat within max_steps.
+def find_period(positions, velocities=None, block_size=1024, max_steps=None):
+    periods = find_axis_periods(positions, velocities, block_size, max_steps)
+    if None in periods:
+        return None
+    return math.lcm(*periods)
+
+def find_period_test():
+    example0 = np.array([[-1, 0, 2], [2, -10, -7], [4, -8, 8], [3, 5, -1]])
+    example1 = np.array([[-8, -10, 0], [5, 5, 10], [2, -7, 3], [9, -8, -3]])
+    assert(find_period(example0) == 2772)
+    assert(find_period(example1, block_size=100) == 4686774924)
+    assert(find_axis_periods(example0) == [18, 28, 44])
+    assert(find_axis_periods(example0, max_steps=5) == [None, None, None])
+    # The positions fit in int16, but the differences between them don't.
+    assert(find_axis_periods([[20000], [-20000]], block_size=1) == [800])
+
+    # Without the zero-velocity shortcut, we should get the same periods by
+    # waiting for the whole state to come around again.
+    positions, velocities = example0.copy(), np.zeros_like(example0)
+    simulate2(positions, velocities, 5, [])
+    assert(find_period(positions, velocities) == 2772)
+
 # First test case from problem:
 #   <x=-1, y=0, z=2>
 #   <x=2, y=-10, z=-7>
@@ -113,7 +381,13 @@ def solve_part1(positions, velocities):
         print(f" {energy[i]:3}", end="")
     print(f" = {np.sum(energy):5}")
 
-def solve_part2(fn, positions, velocities, max_steps):
+# If checkpoint_dir is given, the search on each axis is checkpointed there
+# (see Checkpointer), and picks up from the last checkpoint if the search was
+# interrupted, or gave up after max_steps. Axes which are already done aren't
+# simulated again. Returns the period, or None if no
+# cycle was found.
+def solve_part2(fn, positions, velocities, max_steps, checkpoint_dir=None,
+                checkpoint_steps=None, checkpoint_seconds=60.0):
     # Let's make the unjustified assumption that initial state will repeat (as
     # oppposed to some later state). Then, since all the axes are independent,
     # we can solve the problem by finding the period of the cycle for each axis
@@ -124,11 +398,26 @@ def solve_part2(fn, positions, velocities, max_steps):
         v0 = v.copy()
         t0 = time.monotonic()
 
+        start_step = 0
+        checkpointer = None
+        if checkpoint_dir is not None:
+            checkpointer = Checkpointer(
+                os.path.join(checkpoint_dir, f"day_12_{axis_label}.npz"),
+                x0, v0, checkpoint_steps, checkpoint_seconds)
+            checkpoint = checkpointer.load()
+            if checkpoint:
+                start_step, x[:], v[:], done = checkpoint
+                if done:
+                    print(f"Already found cycle on {axis_label} axis after "
+                          f"{start_step} steps.")
+                    return start_step
+                print(f"Resuming {axis_label} axis from step {start_step}.")
+
         def print_progress(step, positions, velocities):
             if step % 1000 == 0:
                 delta = time.monotonic() - t0
                 pct_done = float(step)/float(max_steps)
-                rate = float(step)/float(delta)
+                rate = float(step - start_step)/float(delta)
                 eta = 'inf'
                 if rate:
                     eta = datetime.timedelta(
@@ -138,12 +427,21 @@ def solve_part2(fn, positions, velocities, max_steps):
         def check_for_repeat_of_initial_state(_, x, v):
             return np.all(np.equal(x, x0)) and np.all(np.equal(v, v0))
 
-        step, x, v = simulate_one_axis(x, v, max_steps, [print_progress, check_for_repeat_of_initial_state])
+        # The checkpointer goes after the check, so we never save the state
+        # where the cycle completes (and then skip past it on resume).
+        callbacks = [print_progress, check_for_repeat_of_initial_state]
+        if checkpointer:
+            callbacks.append(checkpointer)
+        step, x, v = simulate_one_axis(x, v, max_steps, callbacks, start_step)
         if step < max_steps or check_for_repeat_of_initial_state(0, x, v):
             print(f"Found cycle on {axis_label} axis after {step} steps.")
             print(f"{axis_label}0 = {x0}, v0 = {v0}, {axis_label} = {x}, v = {v}")
+            if checkpointer:
+                checkpointer.save(step, x, v, done=True)
             return step
         else:
+            if checkpointer:
+                checkpointer.save(step, x, v)
             print(f"No cycle found on {axis_label} axis, giving up!")
             return None
 
@@ -167,6 +465,37 @@ def solve_part2(fn, positions, velocities, max_steps):
 
     period = math.lcm(x_period, y_period, z_period)
     print(f"Solution repeats with period {period}.")
+    return period
+
+def checkpoint_test():
+    example0 = np.array([[-1, 0, 2], [2, -10, -7], [4, -8, 8], [3, 5, -1]],
+                        dtype=np.int16)
+    with tempfile.TemporaryDirectory() as d:
+        # Give up on the x axis (period 18) part way through, then resume.
+        positions = example0.copy()
+        velocities = np.zeros_like(positions)
+        assert(solve_part2(simulate2, positions, velocities, 10,
+                           checkpoint_dir=d, checkpoint_steps=3) is None)
+        checkpointer = Checkpointer(os.path.join(d, "day_12_x.npz"),
+                                    example0[:, 0], np.zeros(4, np.int16))
+        assert(checkpointer.load()[:1] == (10,))
+
+        positions = example0.copy()
+        velocities = np.zeros_like(positions)
+        assert(solve_part2(simulate2, positions, velocities, 5e9,
+                           checkpoint_dir=d, checkpoint_steps=3) == 2772)
+        # Once each axis is done, running again just reads the periods back.
+        assert(sorted(os.listdir(d)) ==
+               ["day_12_x.npz", "day_12_y.npz", "day_12_z.npz"])
+        assert(checkpointer.load()[0::3] == (18, True))
+        assert(solve_part2(simulate2, positions, velocities, 5e9,
+                           checkpoint_dir=d) == 2772)
+
+        # A checkpoint from a different system is ignored.
+        checkpointer.save(10, example0[:, 0], np.zeros(4, np.int16))
+        other = Checkpointer(checkpointer.path, example0[:, 1],
+                             np.zeros(4, np.int16))
+        assert(other.load() is None)
 
 def profile_simulation(fn, positions, velocities, max_steps):
     # Profile code for part 2, to see if we can speed up the simulation.
@@ -198,6 +527,25 @@ def compare_results(positions, velocities, max_steps):
         print(f"Simulations did not diverge in {step} timesteps.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare simulate2 with the batched simulator")
+    parser.add_argument("--brute-force", action="store_true",
+                        help="find the period by checking every step for a "
+                             "repeat of the initial state")
+    parser.add_argument("--checkpoint-dir", type=str,
+                        help="save (and resume from) checkpoints of the brute "
+                             "force search in this directory")
+    parser.add_argument("--checkpoint-steps", type=int,
+                        help="save a checkpoint every this many steps")
+    parser.add_argument("--checkpoint-seconds", type=float, default=60.0,
+                        help="save a checkpoint every this many seconds")
+    args = parser.parse_args()
+
+    simulate_batch_test()
+    find_period_test()
+    checkpoint_test()
+
     # In part 1, we just have to simulate the system for 1000 time steps, then
     # print the total energy.
     #
@@ -236,7 +584,8 @@ if __name__ == "__main__":
     # state repeats in 4686774924 steps, I guess.
     #
     # Note that since the axes are independent, there's a fast way to find the
-    # period of the cycle; see the solve_part2() method above.
+    # period of the cycle; see the solve_part2() method above, and
+    # find_axis_periods(), which handles this example in well under a second.
     #
     #  positions = np.array([
     #    [-8, -10,  0],
@@ -254,4 +603,14 @@ if __name__ == "__main__":
     ], dtype=np.int16)
 
     velocities = np.zeros((4, 3), dtype=np.int16)
-    solve_part2(simulate2, positions, velocities, 5e9)
+    if args.benchmark:
+        benchmark_batch()
+    elif args.brute_force:
+        solve_part2(simulate2, positions, velocities, 5e9,
+                    checkpoint_dir=args.checkpoint_dir,
+                    checkpoint_steps=args.checkpoint_steps,
+                    checkpoint_seconds=args.checkpoint_seconds)
+    else:
+        periods = find_axis_periods(positions, velocities)
+        print(f"Axis periods are {periods}.")
+        print(f"Solution repeats with period {math.lcm(*periods)}.")
@@ -4,13 +4,17 @@ import argparse
 import collections
 import copy
 import datetime
+import heapq
+import itertools
 import math
+import numpy as np
 import random
 import string
 import time
 
 from collections import deque
 from enum import auto, Enum
+from fractions import Fraction
 
 def solve_part1(g):
     print(g)
@@ -171,79 +175,165 @@ def parse_rules(s):
         rules.append(parse_formula(line))
     return rules
 
-def bfs(rules):
-    def can_apply(state, rule):
-#        print(f"Checking rule {rule} for state {state}.")
-        for reactant in rule.reactants:
-            # ORE is special since we have an infinite amount -- we track how
-            # much we've used, but we can use as much as want.
-            if reactant.name == "ORE":
-                continue
-            if state.get(reactant.name, 0) < reactant.quantity:
-#                print(f"Can't apply rule {rule} to state {state}, don't have enough {reactant.name}.")
-                return False
-#        print(f"Rule {rule} can apply to state {state}.")
-        return True
-
-    def apply_rule(state, rule):
-        # To apply a rule, we consume the reactants and add the products.
-        # Note that ORE is special -- we have an infinite amount, and we
-        # just need to track how much we've used. So instead of consuming
-        # ORE, we add the amount used by the rule to the state.
-        #
-        # Take a copy here since we don't want applying a rule to modify
-        # the source state.
-        new_state = copy.deepcopy(state)
+# Finds the least ORE needed to make quantity units of target, for any set of
+# rules, including ones where a chemical can be made by more than one rule
+# (which solve_part1 and the solvers below assume can't happen).
+#
+# This started out as a naive BFS over the chemicals we had on hand, applying
+# every rule that could be applied, but it checked over 1e7 states for the
+# 165 ORE example without finding a solution. Instead we work backwards from
+# the target, like solve_part1: a state is the chemicals we still need, plus
+# any surplus we've made along the way, and each step expands the next needed
+# chemical with one of the rules that makes it. If that's the only rule for
+# the chemical, we run it enough times to cover the whole need; otherwise we
+# try every number of runs up to that, leaving the rest of the need for the
+# rules after it, since any split of the need between them might be cheapest.
+# (So the search gets much slower as more chemicals get a second rule.)
+# The needs are always expanded in topological order, so a chemical is only
+# expanded once everything which uses it has been.
+#
+# States are searched best first (A*), ordered by the ORE used so far plus a
+# lower bound on the ORE still needed (see ore_lower_bounds), and the best cost
+# for each state is remembered, so states reached again by a different route
+# aren't searched again unless they're cheaper. Logs the number of states
+# expanded per second every report_every states.
+def best_first_search(rules, target="FUEL", quantity=1, log=print,
+                      report_every=10000):
+    product_index = build_product_index(rules)
+
+    # Every rule for a chemical counts here. If the rules have a cycle, this is
+    # still some fixed order, which is all the search needs.
+    order = topological_order(product_index, target, single_rule=False)
+    rank = {name: i for i, name in enumerate(order)}
+    bounds = ore_lower_bounds(rules, order)
+
+    def freeze(needs, surplus, stage):
+        return (tuple(sorted((k, v) for k, v in needs.items() if v)),
+                tuple(sorted((k, v) for k, v in surplus.items() if v)),
+                stage)
+
+    def heuristic(needs, surplus):
+        h = sum(bounds.get(k, math.inf) * v for k, v in needs.items())
+        if h == math.inf:
+            # We need something that can't be made.
+            return math.inf
+        h -= sum(bounds.get(k, 0) * v for k, v in surplus.items())
+        # Round down, with a little slack for floating point error, so this is
+        # never more than the real cost.
+        return max(0, math.floor(h * (1 - 1e-9)))
+
+    def expand(needs, surplus, rule, runs):
+        needs = dict(needs)
+        surplus = dict(surplus)
+        ore = 0
+        # Everything the rule makes goes into the surplus to start with...
+        for product in rule.products:
+            surplus[product.name] = (surplus.get(product.name, 0) +
+                                     product.quantity * runs)
         for reactant in rule.reactants:
             if reactant.name == "ORE":
-                new_state["ORE"] = state["ORE"] + reactant.quantity
+                ore += reactant.quantity * runs
             else:
-                # In all other cases we consume the reactant.
-                new_state[reactant.name] = state[reactant.name] - reactant.quantity
-                # It should never be possible to go negative (the rule should
-                # not have been applied in this case).
-                assert(new_state[reactant.name] >= 0)
-        # Now add any products we obtained.
-        for product in rule.products:
-            # ORE should never be a product.
-            assert(product.name != "ORE")
-            new_state[product.name] = state.get(product.name, 0) + product.quantity
-#        print(f"Applied {rule} to {state}, new state is {new_state}.")
-        return new_state
-
-    # Ok, now we have the rules. We're going to try to use graph search for
-    # this problem. Our state is whatever chemicals we've got, plus how much
-    # ORE we've used so far. Our goal state is any state that has "1 FUEL".
-    #
-    # To start with we'll try a naive BFS search, but I expect this won't
-    # scale and won't always find the min cost to make FUEL (for example
-    # consider any set of rules like "1000000 ORE => 1 FUEL" and then a
-    # longer, more complex chain of steps that produces 1 FUEL using less
-    # than 1000000 ORE).
-    #
-    # We start having used no ORE and with no other products.
+                needs[reactant.name] = (needs.get(reactant.name, 0) +
+                                        reactant.quantity * runs)
+        # ...and then gets used up on whatever we need.
+        for k in list(needs):
+            c = min(needs[k], surplus.get(k, 0))
+            if c:
+                needs[k] -= c
+                surplus[k] -= c
+            if not needs[k]:
+                del needs[k]
+        return needs, surplus, ore
+
     start = time.monotonic()
-    c = 0
-    q = deque([{'ORE': 0}])
-    while q:
-        state = q.popleft()
-#        print(f"Considering state {state}.")
-        c += 1
-        if c % 10000 == 0:
-            delta = time.monotonic() - start
-            sps = float(c) / float(delta)
-            print(f"Checked {c} states in {delta:0.03f} s, {sps:0.03f} states / s. Current state: {state}.")
-        # Check for a goal state.
-        if 'FUEL' in state:
-            # We got FUEL!
-            print()
-            print(f"Reached goal state: {state}.")
-            print(f"ORE cost to create fuel was {state['ORE']}.")
+    expanded = 0
+    counter = itertools.count()
+    needs = {target: quantity}
+    best = {freeze(needs, {}, None): 0}
+    heap = [(heuristic(needs, {}), 0, next(counter), needs, {}, None)]
+    result = None
+    while heap:
+        _, cost, _, needs, surplus, stage = heapq.heappop(heap)
+        key = freeze(needs, surplus, stage)
+        if best.get(key, math.inf) < cost:
+            # We've already found a cheaper way to get here.
+            continue
+        if not needs:
+            result = cost
             break
-        # Not a goal state; apply production rules.
-        for rule in rules:
-            if can_apply(state, rule):
-                q.append(apply_rule(state, rule))
+
+        expanded += 1
+        if expanded % report_every == 0:
+            delta = time.monotonic() - start
+            log(f"Expanded {expanded} states in {delta:0.03f} s, "
+                f"{expanded / delta:0.03f} states / s, current state has "
+                f"used {cost} ORE.")
+
+        name = min(needs, key=lambda k: rank.get(k, len(rank)))
+        need = needs[name]
+        producers = product_index.get(name, [])
+        # To split a need between several rules, we pick how many times to
+        # run each rule, in the order they're listed: stage is (name, i) if
+        # we're part way through a split, and rules before i have already been
+        # run (or skipped). Trying the rules in a fixed order means we reach
+        # each split once, rather than once per order the rules could be run
+        # in.
+        first = stage[1] if stage and stage[0] == name else 0
+        for i in range(first, len(producers)):
+            rule = producers[i]
+            made = sum(p.quantity for p in rule.products if p.name == name)
+            full = -(-need // made)
+            if i == len(producers) - 1:
+                # The last rule has to cover whatever's left.
+                runs = [full]
+            else:
+                # Any number of runs might be part of the cheapest split.
+                runs = range(1, full + 1)
+            for k in runs:
+                new_needs, new_surplus, ore = expand(needs, surplus, rule, k)
+                new_stage = (name, i + 1) if name in new_needs else None
+                new_cost = cost + ore
+                new_key = freeze(new_needs, new_surplus, new_stage)
+                if new_cost < best.get(new_key, math.inf):
+                    best[new_key] = new_cost
+                    f = new_cost + heuristic(new_needs, new_surplus)
+                    if f < math.inf:
+                        heapq.heappush(heap, (f, new_cost, next(counter),
+                                              new_needs, new_surplus,
+                                              new_stage))
+
+    delta = time.monotonic() - start
+    rate = expanded / delta if delta else math.inf
+    log(f"Expanded {expanded} states in {delta:0.03f} s ({rate:0.03f} "
+        f"states / s).")
+    return result
+
+# Returns a lower bound on the ORE needed to make one unit of each chemical, as
+# a dict, by letting rules run a fraction of a time and taking the cheapest
+# rule for each chemical. (A rule with several products has its cost split
+# between them.) Chemicals that can't be made from ORE are left out. Working
+# backwards through the topological order gets every chemical in one sweep,
+# unless the rules have cycles, in which case we sweep until nothing changes.
+def ore_lower_bounds(rules, order):
+    bounds = {"ORE": 1.0}
+    for _ in range(len(order) + 1):
+        changed = False
+        for name in reversed(order):
+            for rule in rules:
+                made = sum(p.quantity for p in rule.products if p.name == name)
+                if not made:
+                    continue
+                cost = sum(bounds.get(r.name, math.inf) * r.quantity
+                           for r in rule.reactants)
+                per_unit = cost / (made * len(rule.products))
+                if per_unit < bounds.get(name, math.inf):
+                    bounds[name] = per_unit
+                    changed = True
+        if not changed:
+            return bounds
+    # Didn't settle down, so fall back to the trivial bound.
+    return {name: 0.0 for name in bounds}
 
 # Returns an index of chemicals -> rules in which the chemical appears in the
 # product list.
@@ -322,6 +412,323 @@ def solve_part1():
         print(f"New constraints are {constraints}, surplus is {surplus}, ORE needed is {ore_needed}.")
     print(f"{ore_needed} ORE needed to produce 1 FUEL.")
 
+# Returns the chemicals in topological order, starting from FUEL: each chemical
+# comes before every chemical used to make it, so by the time we get to a
+# chemical we know the total amount of it we need. Like solve_part1, this
+# assumes each chemical is produced by exactly one rule, with one product,
+# unless single_rule is False, in which case the reactants of every rule that
+# makes a chemical come after it.
+def topological_order(product_index, target="FUEL", single_rule=True):
+    order = []
+    visited = set()
+    # Iterative post-order DFS: a chemical is added once all of its reactants
+    # have been added.
+    stack = [(target, False)]
+    while stack:
+        name, expanded = stack.pop()
+        if expanded:
+            order.append(name)
+            continue
+        if name in visited:
+            continue
+        visited.add(name)
+        stack.append((name, True))
+        if name == "ORE":
+            continue
+        rules = product_index.get(name, [])
+        if single_rule:
+            assert(len(rules) == 1)
+            assert(len(rules[0].products) == 1)
+        for rule in rules:
+            for reactant in rule.reactants:
+                if reactant.name not in visited:
+                    stack.append((reactant.name, False))
+    # Reactants come before the chemicals made from them in a post-order, so
+    # we want the reverse.
+    order.reverse()
+    return order
+
+# Returns the ORE needed to make the given amount of FUEL. Each chemical is
+# only expanded once, after every chemical that uses it (see
+# topological_order), so this is one pass over the rules whatever the amount,
+# and it's all integer arithmetic, so it's exact for any amount.
+def ore_required(product_index, order, fuel):
+    needed = {"FUEL": fuel}
+    for name in order:
+        if name == "ORE":
+            continue
+        quantity = needed.get(name, 0)
+        if quantity <= 0:
+            continue
+        rule = product_index[name][0]
+        # Run the rule k times, rounding up (any extra is surplus).
+        k = -(-quantity // rule.products[0].quantity)
+        for reactant in rule.reactants:
+            needed[reactant.name] = (needed.get(reactant.name, 0) +
+                                     reactant.quantity * k)
+    return needed.get("ORE", 0)
+
+# Returns the most FUEL that can be made with ore_budget ORE. The ORE needed
+# only goes up as the FUEL goes up, so we can double the FUEL until it's too
+# much (galloping), then binary search, which takes O(log budget) calls to
+# ore_required.
+def max_fuel(product_index, order, ore_budget=10**12):
+    if ore_required(product_index, order, 1) > ore_budget:
+        return 0
+    lo = 1
+    hi = 2
+    while ore_required(product_index, order, hi) <= ore_budget:
+        lo = hi
+        hi *= 2
+    # Now we can make lo FUEL but not hi.
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if ore_required(product_index, order, mid) <= ore_budget:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+# A compiled version of the rules, for answering lots of queries. Chemicals
+# are numbered in topological order (see topological_order), so FUEL is 0 and
+# ORE is last, and the rules are stored as arrays: output[i] is how much of
+# chemical i its rule makes, and inputs[i, j] is how much of chemical j that
+# rule uses. Rules that don't lead to FUEL are left out.
+#
+# Queries take arrays of FUEL amounts and do one pass over the rules for all of
+# them at once. Amounts are int64, so queries are only exact while the ORE
+# needed fits; max_exact_fuel is a safe limit on the FUEL amount.
+class ReactionPlan(object):
+    def __init__(self, rules, target="FUEL"):
+        product_index = build_product_index(rules)
+        self.names = topological_order(product_index, target)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+        self.ore = self.ids["ORE"]
+        assert(self.ore == n - 1)
+
+        self.output = np.ones(n, dtype=np.int64)
+        self.inputs = np.zeros((n, n), dtype=np.int64)
+        for i, name in enumerate(self.names[:-1]):
+            rule = product_index[name][0]
+            self.output[i] = rule.products[0].quantity
+            for reactant in rule.reactants:
+                self.inputs[i, self.ids[reactant.name]] += reactant.quantity
+        # The reactants of each rule, as (ids, quantities), so a pass only
+        # touches the chemicals each rule actually uses.
+        self.reactants = []
+        for i in range(n):
+            ids = np.flatnonzero(self.inputs[i])
+            self.reactants.append((ids, self.inputs[i, ids]))
+
+        # per_unit[i, j] is how much of chemical j goes into one unit of
+        # chemical i, if we could run rules a fraction of a time. Rows are
+        # filled in from ORE backwards, so every reactant's row is done first.
+        # This is a lower bound on the real amounts; in particular
+        # unit_ore is a lower bound on the ORE cost of each chemical.
+        per_unit = np.eye(n)
+        for i in reversed(range(n - 1)):
+            per_unit[i] += (self.inputs[i] @ per_unit) / self.output[i]
+        self.unit_ore = per_unit[:, self.ore]
+        # The same lower bound for FUEL, as an exact fraction, so that
+        # max_fuel can start from an exact upper bound on big budgets.
+        fuel_ore = [Fraction(0)] * n
+        fuel_ore[self.ore] = Fraction(1)
+        for i in reversed(range(n - 1)):
+            ids, quantities = self.reactants[i]
+            fuel_ore[i] = sum(int(q) * fuel_ore[j]
+                              for j, q in zip(ids, quantities))
+            fuel_ore[i] /= int(self.output[i])
+        self.fuel_ore = fuel_ore[0]
+
+        # Each rule makes less than one run's worth of surplus, so the amount
+        # of chemical j needed for some FUEL is under per_unit[FUEL, j] per
+        # FUEL, plus the amount of j in one run of every rule. Every number
+        # in a pass (the amount of each chemical needed, and what each rule
+        # adds to it) is at most one of these totals, so keeping all of them
+        # under 2^62 keeps the int64 arithmetic exact.
+        slack = self.output[:-1] @ per_unit[:-1]
+        limits = (2**62 - slack) / per_unit[0]
+        self.max_exact_fuel = int(limits.min())
+
+    # Runs the rules for the given FUEL amounts (an array of any shape).
+    # output can be an array of shape (chemicals,) + fuel.shape, to run each
+    # query with different rule outputs.
+    def _run(self, fuel, output=None):
+        fuel = np.asarray(fuel, dtype=np.int64)
+        if np.any(fuel > self.max_exact_fuel):
+            raise OverflowError(f"Can't make more than {self.max_exact_fuel} "
+                                "FUEL exactly!")
+        if output is None:
+            output = self.output
+        needed = np.zeros((len(self.names),) + fuel.shape, dtype=np.int64)
+        needed[0] = fuel
+        for i in range(len(self.names) - 1):
+            # Run the rule enough times to make what we need, rounding up.
+            runs = -(-needed[i] // output[i])
+            ids, quantities = self.reactants[i]
+            needed[ids] += np.multiply.outer(quantities, runs)
+        return needed[self.ore]
+
+    # Returns the ORE needed for each FUEL amount; fuel can be a number or an
+    # array.
+    def ore_required(self, fuel):
+        ore = self._run(fuel)
+        return int(ore) if ore.ndim == 0 else ore
+
+    # Returns the most FUEL that can be made with ore_budget ORE. Since
+    # fuel_ore is a lower bound on the cost, we know the answer is at most
+    # ore_budget / fuel_ore. Then each pass tries batch_size amounts spread
+    # across the range that's left, which shrinks it by a factor of about
+    # batch_size. The amounts are worked out with Python ints, since floats
+    # can't tell apart amounts above 2^53.
+    #
+    # Raises OverflowError if the answer might be more than max_exact_fuel.
+    def max_fuel(self, ore_budget=10**12, batch_size=64):
+        lo = 0
+        hi = math.floor(ore_budget / self.fuel_ore)
+        capped = hi > self.max_exact_fuel
+        hi = min(hi, self.max_exact_fuel)
+        # Invariant: we can make lo FUEL, and either hi is the limit or we
+        # can't make hi + 1.
+        while lo < hi:
+            steps = max(batch_size - 1, 1)
+            candidates = sorted({lo + 1 + (hi - lo - 1) * k // steps
+                                 for k in range(batch_size)})
+            candidates = np.array(candidates, dtype=np.int64)
+            ok = candidates[self._run(candidates) <= ore_budget]
+            if len(ok) == len(candidates):
+                lo = int(hi)
+                break
+            lo = int(ok[-1]) if len(ok) else lo
+            hi = int(candidates[len(ok)]) - 1
+        if capped and lo == self.max_exact_fuel:
+            raise OverflowError(f"Can make at least {lo} FUEL, which is as "
+                                "much as we can check exactly!")
+        return lo
+
+    # Returns, for each rule, the ORE that would be saved in making fuel FUEL
+    # if the rule made extra more units of its product. All the rules are done
+    # in a single pass, with one column per rule.
+    def ore_saved(self, fuel=1, extra=1):
+        n = len(self.names) - 1
+        output = np.repeat(self.output[:, None], n, axis=1)
+        output[np.arange(n), np.arange(n)] += extra
+        ore = self._run(np.full(n, fuel), output)
+        base = self.ore_required(fuel)
+        return {self.names[i]: int(base - ore[i]) for i in range(n)}
+
+def quiet(*args, **kwargs):
+    pass
+
+def best_first_search_test():
+    example_1 = [
+        "10 ORE => 10 A",
+        "1 ORE => 1 B",
+        "7 A, 1 B => 1 C",
+        "7 A, 1 C => 1 D",
+        "7 A, 1 D => 1 E",
+        "7 A, 1 E => 1 FUEL",
+    ]
+    assert(best_first_search(parse_rules(example_1), log=quiet) == 31)
+    # A second, more expensive way to make FUEL shouldn't be used...
+    rules = parse_rules(example_1 + ["1000000 ORE => 1 FUEL"])
+    assert(best_first_search(rules, log=quiet) == 31)
+    # ...but a cheaper one should.
+    rules = parse_rules(example_1 + ["20 ORE => 1 FUEL"])
+    assert(best_first_search(rules, log=quiet) == 20)
+    # The cheapest way to get 13 A is 10 from the first rule and 3 from the
+    # second.
+    rules = parse_rules(["10 ORE => 10 A", "2 ORE => 1 A", "13 A => 1 FUEL"])
+    assert(best_first_search(rules, log=quiet) == 16)
+    # Here the cheapest is one run of the first rule and four of the third;
+    # running the first rule as many times as fits in the need (twice) isn't.
+    rules = parse_rules(["8 ORE => 8 A", "6 ORE => 2 A", "3 ORE => 3 A",
+                         "20 A => 1 FUEL"])
+    assert(best_first_search(rules, log=quiet) == 20)
+    # A rule with two products. It's cheaper to run the first rule twice (and
+    # waste some A and B) than to make the last B with the second rule.
+    rules = parse_rules(["5 ORE => 2 A, 3 B", "7 ORE => 1 B",
+                         "2 A, 4 B => 1 FUEL"])
+    assert(best_first_search(rules, log=quiet) == 10)
+    assert(best_first_search(rules, quantity=2, log=quiet) == 15)
+    # Nothing makes C.
+    rules = parse_rules(["1 C => 1 FUEL"])
+    assert(best_first_search(rules, log=quiet) is None)
+
+def reaction_plan_overflow_test():
+    # A chemical which needs much more of an intermediate than of ORE: the
+    # amount of A needed overflows long before the ORE does.
+    rules = parse_rules(["1 ORE => 1000 A", "1000 A => 1 FUEL"])
+    product_index = build_product_index(rules)
+    order = topological_order(product_index)
+    plan = ReactionPlan(rules)
+    fuel = plan.max_exact_fuel
+    assert(plan.ore_required(fuel) == ore_required(product_index, order, fuel))
+    try:
+        plan.ore_required(fuel + 1)
+        assert(False)
+    except OverflowError:
+        pass
+    assert(plan.max_fuel(10**12) == 10**12)
+    try:
+        plan.max_fuel(4 * 10**18)
+        assert(False)
+    except OverflowError:
+        pass
+
+    # Budgets too big to be exact as floats.
+    rules = parse_rules(["1 ORE => 1 A", "1 A => 1 FUEL"])
+    product_index = build_product_index(rules)
+    order = topological_order(product_index)
+    plan = ReactionPlan(rules)
+    for budget in [2**53 + 1, 10**16 + 3, 10**17 + 3, 2**61 + 7,
+                   plan.max_exact_fuel - 1]:
+        assert(plan.max_fuel(budget) == max_fuel(product_index, order, budget))
+
+def reaction_test():
+    # The ORE needed for 1 FUEL, and the most FUEL 1e12 ORE can make, for
+    # each example.
+    tests = [
+        ("example_2", 165, None),
+        ("example_3", 13312, 82892753),
+        ("example_4", 180697, 5586022),
+        ("example_5", 2210736, 460664),
+    ]
+    for path, ore, fuel in tests:
+        with open(path) as f:
+            product_index = build_product_index(parse_rules(f))
+        order = topological_order(product_index)
+        assert(ore_required(product_index, order, 1) == ore)
+        if fuel is not None:
+            assert(max_fuel(product_index, order) == fuel)
+
+        # The compiled plan should give the same answers, for a whole batch at
+        # once.
+        with open(path) as f:
+            rules = parse_rules(f)
+        plan = ReactionPlan(rules)
+        assert(plan.ore_required(1) == ore)
+        amounts = np.array([0, 1, 2, 3, 10, 12345, 10**9])
+        assert(list(plan.ore_required(amounts)) ==
+               [ore_required(product_index, order, a) for a in amounts])
+        if fuel is not None:
+            assert(plan.max_fuel() == fuel)
+            assert(plan.max_fuel(batch_size=2) == fuel)
+        assert(plan.max_fuel(ore - 1) == 0)
+
+        assert(best_first_search(rules, log=quiet) == ore)
+
+        # Check the sensitivity of a few rules by changing the rule itself.
+        saved = plan.ore_saved(fuel=100)
+        base = plan.ore_required(100)
+        for name in plan.names[:3]:
+            product = product_index[name][0].products[0]
+            product.quantity += 1
+            changed = ore_required(product_index, order, 100)
+            product.quantity -= 1
+            assert(saved[name] == base - changed)
+
 if __name__ == '__main__':
     # In this problem we're given a set of equations showing how we can combine
     # various chemical feedstocks to get fuel for our ship. We need to figure
@@ -341,11 +748,14 @@ if __name__ == '__main__':
 
     # This example requires 165 ORE to produce 1 FUEL.
     #
-    # The naive BFS search checks over 1e7 states for this example without
+    # The naive BFS search checked over 1e7 states for this example without
     # finding a solution, so either there's a bug in the code, or it's not
     # fast enough to solve this problem.
     #
-    # Instead let's try a constraint satisfaction approach.
+    # Instead let's try a constraint satisfaction approach. (The search has
+    # since been replaced with best_first_search, which works backwards from
+    # FUEL like the constraint approach does; it's only needed if a chemical
+    # can be made by more than one rule.)
     example_2 = [
         "9 ORE => 2 A",
         "8 ORE => 3 B",
@@ -369,84 +779,31 @@ if __name__ == '__main__':
         print(f"  {rule}")
     print()
 
-    # bfs(rules)
+    # best_first_search(rules)
 
-    # To apply the constraints, we need to index the rules by product so that
-    # we can quickly find the next set of constraints each time through the
-    # loop below.
-    product_index = build_product_index(rules)
-    print(product_index)
+    reaction_test()
+    reaction_plan_overflow_test()
+    best_first_search_test()
 
-    # Sometimes when applying a rule we get "too much" of a reactant (ie. we
-    # need to apply a rule k times to get enough, and it produces m each time,
-    # but k * m > n). This tracks the "surplus" we've produced.
-    surplus = {}
-
-    # The total amount of ORE we've spent.
-    ore_needed = 0
+    # Index the rules by product, and work out the order in which to expand
+    # them (see topological_order).
+    product_index = build_product_index(rules)
+    order = topological_order(product_index)
 
-    # The total amount of FUEL produced.
-    fuel_produced = 0
+    ore_needed = ore_required(product_index, order, 1)
+    print(f"{ore_needed} ORE needed to produce 1 FUEL.")
 
     # In part 2 we have 1e12 ORE to spend, and we need to produce as much FUEL
-    # as possible. So we loop until we hit 1e12 ORE spent.
-    start = time.monotonic()
-    while ore_needed < 1e12:
-        # The starting constraint is that we need 1 FUEL.
-        constraints = {'FUEL': 1}
-        while constraints:
-            # We're going to assume that each rule only has a single product, and
-            # that each product is only produced by one rule, for now. To update
-            # our state, we'll pop the "first" item from the constraints, find
-            # the rule that produces it, and apply it.
-            product_name, product_quantity = constraints.popitem()
-
-            # Apply any surplus units we already have (possibly from expanding
-            # a different rule) to the constraint.
-            if surplus.get(product_name, 0) > 0:
-                c = min(product_quantity, surplus[product_name])
-                product_quantity -= c
-                surplus[product_name] -= c
-                # print(f"Applied {c} units of {product_name} from surplus, still need {product_quantity} units.")
-
-            # Did we have enough units already? If not expand a rule to update
-            # our constraints.
-            if product_quantity > 0:
-                # Get the rule that produces this chemical.
-                # print(f"Expanding product {product_name}.")
-                product_rules = product_index[product_name]
-                assert(len(product_rules) == 1)
-                rule = product_rules[0]
-                assert(len(rule.products) == 1)
-
-                # Apply the rule to our state. We need to apply the rule k times to
-                # get enough of the inputs, but this may produce more than we
-                # actually need (see note about surplus above).
-                q = rule.products[0].quantity
-                k = math.ceil(float(product_quantity) / float(q))
-                # print(f"Applying rule {rule} to constraints {k} times.")
-
-                # "Store" any extra units.
-                extra_units = q * k - product_quantity
-                if extra_units > 0:
-                    # "Store" the surplus
-                    surplus[product_name] = extra_units
-
-                # We need enough of the reactants to run this rule k times, so add
-                # those to our constraints.
-                for reactant in rule.reactants:
-                    if reactant.name != 'ORE':
-                        constraints[reactant.name] = constraints.get(reactant.name, 0) + reactant.quantity * k
-                    else:
-                        # ORE is special; it's not a constraint, we just track how
-                        # much we used.
-                        ore_needed += reactant.quantity * k
-            # print(f"New constraints are {constraints}, surplus is {surplus}, ORE needed is {ore_needed}.")
-        fuel_produced += 1
-        if fuel_produced % 10000 == 0:
-            delta = time.monotonic() - start
-            ops = float(ore_needed) / float(delta)
-            ore_left = 1e12 - ore_needed
-            eta = datetime.timedelta(seconds=float(ore_left) / float(ops))
-            print(f"Produced {fuel_produced} FUEL with {ore_needed} ORE ({ops} ops, eta {eta}).")
+    # as possible.
+    fuel_produced = max_fuel(product_index, order, 10**12)
+    ore_needed = ore_required(product_index, order, fuel_produced)
     print(f"Produced {fuel_produced} FUEL with {ore_needed} ORE.")
+
+    # Which rules would save the most ORE if they made one more unit?
+    plan = ReactionPlan(rules)
+    assert(plan.max_fuel(10**12) == fuel_produced)
+    saved = plan.ore_saved(fuel=fuel_produced)
+    print(f"ORE saved in making {fuel_produced} FUEL if a rule made one more "
+          "unit:")
+    for name, ore in sorted(saved.items(), key=lambda kv: -kv[1])[:5]:
+        print(f"  {name}: {ore}")
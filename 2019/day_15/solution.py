@@ -24,6 +24,7 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
+import argparse
 import curses
 import intcode
 import random
@@ -32,6 +33,7 @@ import time
 from common import Point
 from collections import defaultdict, deque
 from enum import IntEnum
+from render import CursesBackend, Renderer
 
 class Tile(IntEnum):
     WALL = 0  # droid hit a wall trying to enter this space
@@ -50,6 +52,16 @@ class Output(IntEnum):
     MOVED = 1  # moved to requested space
     OXYGEN = 2  # moved and found oxygen system
 
+# Strategy the robot uses to pick the next space to explore.
+class Planner(IntEnum):
+    # Path (using bfs) to the unknown space closest to the robot, by Manhattan
+    # distance. Every choice costs a sort of the frontier plus a search.
+    NEAREST_FRONTIER = 0
+    # Depth-first search with backtracking. Each move only looks at the four
+    # spaces around the robot (or pops the backtrack stack), so choosing a
+    # move is O(1), and the robot crosses each open space at most twice.
+    DFS = 1
+
 class Map(object):
     def __init__(self):
         self.map_ = defaultdict(dict)
@@ -121,7 +133,10 @@ class HaltError(Exception):
     pass
 
 class Robot(object):
-    def __init__(self, program, on_move=None, log_fn=None):
+    # If stop_at_oxygen is set, the robot halts as soon as it finds the oxygen
+    # system; otherwise it keeps going until it has explored the whole map.
+    def __init__(self, program, on_move=None, log_fn=None,
+                 planner=Planner.DFS, stop_at_oxygen=False):
         self.position = Point(0, 0)
         self.last_move = None
         self.im = intcode.IntcodeMachine(program, input_fn=self._input, output_fn=self._output)
@@ -134,6 +149,13 @@ class Robot(object):
         # If we're pathing to a space, this is set to the current path
         # we're following.
         self.current_path = None
+        self.planner = planner
+        self.stop_at_oxygen = stop_at_oxygen
+        # Used by the DFS planner: the spaces we need to walk back through
+        # (most recent last) to return to the start, and whether the move we
+        # just made was a step back onto one of them.
+        self.backtrack = []
+        self.backtracking = False
         # The space we start on is EMPTY by definition.
         self.map_.set_tile(Point(0, 0), Tile.EMPTY)        
 
@@ -182,7 +204,27 @@ class Robot(object):
         self._log(f"[input] Finding path to target: {target}.")
         return bfs(self.position, target, self.map_, self._log)
 
+    def _get_next_dfs_move(self):
+        # Prefer stepping into an unexplored space next to us.
+        for p in points_around(self.position):
+            if self.map_.get_tile(p) == Tile.UNKNOWN:
+                self.backtracking = False
+                return p
+
+        # Nothing new around here; back up one space. If there's nowhere left
+        # to back up to then we've been everywhere we can reach.
+        if not self.backtrack:
+            raise HaltError()
+        self.backtracking = True
+        return self.backtrack[-1]
+
     def _input(self, prompt):
+        if self.planner == Planner.DFS:
+            self.last_move = self._get_next_dfs_move()
+            move = self._pos_to_move(self.position, self.last_move)
+            self._log(f"[input] Moving {str(move)}, new position would be {self.last_move}.")
+            return move
+
         if not self.current_path:
             # Get path to closest unexplored space.
             path = self._get_path_to_closest_unknown_space()
@@ -203,8 +245,16 @@ class Robot(object):
     def _output(self, v):
         self._log(f"[output] Got output: {str(Output(v))}.")
         
-        # If we're pathing, we should never hit a WALL.
+        # If we're pathing (or backing up), we should never hit a WALL.
         assert(not self.current_path or (self.current_path and v != Output.WALL))
+        assert(not self.backtracking or v != Output.WALL)
+
+        # Keep the DFS backtrack stack in sync with our position.
+        if v != Output.WALL and self.planner == Planner.DFS:
+            if self.backtracking:
+                self.backtrack.pop()
+            else:
+                self.backtrack.append(self.position)
 
         # Update map and robot position.
         if v == Output.WALL:
@@ -227,14 +277,13 @@ class Robot(object):
             self._remove_from_frontier(self.last_move)
             for p in points_around(self.last_move):
                 self._add_to_frontier(p)
-            # TODO: we used to stop here but now we want to explore the whole
-            # map; it'd be nice if we could make the code more flexible so
-            # that we could do either.
-            # raise HaltError()
 
         if self.on_move:
             self.on_move(self.position, self.last_move, v)
 
+        if v == Output.OXYGEN and self.stop_at_oxygen:
+            raise HaltError()
+
     def run(self):
         # We should think about how to handle the case where we never find the
         # goal state (e.g. there is not path) -- right now the robot will search
@@ -267,33 +316,29 @@ def flood_fill(grid, start_pos, cb=None, log=None):
         frontier = next_frontier
     return fill_time
 
-def curses_main(stdscr): 
-    pad_width = 50
-    pad_height = 50
-    pad = curses.newpad(pad_height, pad_width)
+# Curses color pairs used when drawing the map.
+PATH_COLOR = 1
+OXYGEN_COLOR = 2
 
-    # Put a box around the pad border so we can see where it is in our
-    # "window".
-    pad.box()
+# Explores the map with the robot, drawing it into renderer as we go, then
+# finds the best path to the oxygen system and animates the oxygen filling the
+# map. wait_fn is called to pause between the two parts (e.g. to wait for a
+# keypress); fill_delay is the time to pause between flood fill steps.
+def explore(renderer, wait_fn=lambda: None, fill_delay=0.0):
+    # The map has the origin at the center of a 50x50 "screen".
+    tx = 25
+    ty = 25
 
     # Seed random so that we always get the same sequence of random choices
     # for the robot.
     random.seed(0)
 
-    tx = pad_width // 2
-    ty = pad_height // 2
-
     # The last known position of the robot, in "screen coordinates".
     last_pos = Point(tx, ty)
 
     # The position of the oxygen system, in "screen coordinates".
     oxygen_pos = None
 
-    def refresh_pad(pad):
-        width = min(pad_width, curses.COLS - 1)
-        height = min(pad_height, curses.LINES - 1)
-        pad.refresh(0, 0, 0, 0, height, width)
-
     def on_move(pos, last_move, result):
         nonlocal last_pos, oxygen_pos
 
@@ -302,7 +347,7 @@ def curses_main(stdscr):
         last_move = last_move.translate(tx, ty)
 
         if result == Output.WALL:
-            pad.addch(last_move.y, last_move.x, '#')
+            renderer.set_char(last_move.x, last_move.y, '#')
         elif result == Output.OXYGEN:
             # Save position of oxygen system for later use (we'll draw it on
             # the map when the robot moves off of this space).
@@ -313,19 +358,17 @@ def curses_main(stdscr):
             c = '.'
             if oxygen_pos and last_pos == oxygen_pos:
                 c = 'O'
-            pad.addch(last_pos.y, last_pos.x, c)
+            renderer.set_char(last_pos.x, last_pos.y, c)
         else:
-            pad.addch(ty, tx, '<')
+            renderer.set_char(tx, ty, '<')
 
         # draw robot in new position
-        pad.addch(pos.y, pos.x, '@')
+        renderer.set_char(pos.x, pos.y, '@')
 
         last_pos = pos
 
-        # Draw pad in our "window".
-        #
         # TODO: center pad in window if it's smaller
-        refresh_pad(pad)
+        renderer.flush()
 
     # TODO: show log messages in curses interface
     log_file = open("run.log", "w")
@@ -335,14 +378,13 @@ def curses_main(stdscr):
     program = intcode.read_initial_memory("input")
     r = Robot(program, on_move=on_move, log_fn=log)
     r.run()
-    
+
     # After the robot halts, we should have the whole map in its "memory".
     # Use it to get the shortest path from the start position to the oxygen
     # system.
     best_path = bfs(Point(0, 0), oxygen_pos.translate(-tx, -ty), r.map_)
 
-    # Color the best path in the curses display.
-    curses.init_pair(1, curses.COLOR_RED, curses.COLOR_BLACK)
+    # Color the best path.
     for p in best_path:
         p = p.translate(tx, ty)
         c = '.'
@@ -350,57 +392,51 @@ def curses_main(stdscr):
             c = '>'
         elif p == oxygen_pos:
             c = 'O'
-        pad.addch(p.y, p.x, c, curses.color_pair(1))
-    refresh_pad(pad)
-    pad.getch()
+        renderer.set_char(p.x, p.y, c, PATH_COLOR)
+    renderer.flush(force=True)
+    wait_fn()
 
     # In part 2, we need to figure out how long it takes for the oxgygen to
     # fill the space after the robot repairs the oxygen system. The oxygen
     # fills all adjacent squares at each time step, so the time taken is just
     # the shortest path to the square farthest away from the oxygen system.
     # For fun let's animate "filling" all the squares on the map.
-    curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
     def fill_cb(filled_spaces):
         for p in filled_spaces:
             # This point filled up with oxygen on this time step.
             p = p.translate(tx, ty)
-            pad.addch(p.y, p.x, 'O', curses.color_pair(2))
-        refresh_pad(pad)
-        time.sleep(0.125)
+            renderer.set_char(p.x, p.y, 'O', OXYGEN_COLOR)
+        if fill_delay:
+            renderer.flush(force=True)
+            time.sleep(fill_delay)
+        else:
+            renderer.flush()
     fill_time = flood_fill(r.map_, oxygen_pos.translate(-tx, -ty), fill_cb, log)
-    pad.getch()
-
-    # Maybe stop and wait for a keypress here?
-    # time.sleep(5)
-
-    # Extra a character from the pad, handling the ALT_CHARSET crap.
-    def get_char(x, y):
-        c = pad.inch(y, x)
-        # log(f"[get_char] x = {x}, y = {y}, c = {hex(c)}.")
-        if c & curses.A_ALTCHARSET:
-            if c == curses.ACS_ULCORNER:
-                return u"\u250c"
-            elif c == curses.ACS_HLINE:
-                return u"\u2500"
-            elif c == curses.ACS_URCORNER:
-                return u"\u2510"
-            elif c == curses.ACS_VLINE:
-                return u"\u2502"
-            elif c == curses.ACS_LLCORNER:
-                return u"\u2514"
-            elif c == curses.ACS_LRCORNER:
-                return u"\u2518"
-            return ''
-        return chr(c & ~curses.A_ATTRIBUTES)
-
-    # Capture pad contents.
-    pad_contents = ""
-    for row in range(0, pad_height):
-        for col in range(0, pad_width):
-            pad_contents += get_char(col, row)
-        pad_contents += "\n"
-
-    return best_path, pad_contents, fill_time
+    renderer.flush(force=True)
+    wait_fn()
+
+    return best_path, fill_time
+
+def curses_main(stdscr):
+    pad_width = 50
+    pad_height = 50
+    pad = curses.newpad(pad_height, pad_width)
+
+    # Put a box around the pad border so we can see where it is in our
+    # "window".
+    pad.box()
+
+    curses.init_pair(PATH_COLOR, curses.COLOR_RED, curses.COLOR_BLACK)
+    curses.init_pair(OXYGEN_COLOR, curses.COLOR_GREEN, curses.COLOR_BLACK)
+
+    renderer = Renderer(CursesBackend(pad, pad_width, pad_height))
+    best_path, fill_time = explore(renderer, pad.getch, 0.125)
+    return best_path, renderer.snapshot(), fill_time
+
+def headless_main():
+    renderer = Renderer()
+    best_path, fill_time = explore(renderer)
+    return best_path, renderer.snapshot(), fill_time
 
 
 def flood_fill_test():
@@ -439,7 +475,15 @@ def flood_fill_test():
     print(f"Map filled in {fill_time} time steps.")
 
 if __name__ == "__main__":
-    best_path, pad_contents, fill_time = curses.wrapper(curses_main)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true",
+                        help="don't draw anything until the end")
+    args = parser.parse_args()
+
+    if args.headless:
+        best_path, pad_contents, fill_time = headless_main()
+    else:
+        best_path, pad_contents, fill_time = curses.wrapper(curses_main)
     print(pad_contents)
     print(f"Thanks for playing! Best path to oxygen system is "
           f"{len(best_path) - 1} moves long. It took {fill_time} time steps "
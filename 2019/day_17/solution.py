@@ -5,13 +5,217 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
+import argparse
 import curses
 import curses.ascii
 import intcode
+import numpy as np
 import random
+import time
 
+from collections import namedtuple
 from common import Point
 from enum import Enum, IntEnum, auto
+from render import CursesBackend, Renderer
+
+# Characters the camera uses for the robot, and the direction it's facing.
+ROBOT_FACING = {
+    b"^": Point(0, -1),
+    b">": Point(1, 0),
+    b"v": Point(0, 1),
+    b"<": Point(-1, 0),
+}
+
+# Runs the ASCII program with the robot asleep, which just sends us the camera
+# image, and returns the image (see parse_camera_image).
+def capture_camera_image(program):
+    output = bytearray()
+    im = intcode.IntcodeMachine(program, output_fn=output.append)
+    im.run()
+    return parse_camera_image(output)
+
+# Turns the ASCII camera output into a 2d array of characters (dtype "S1"),
+# indexed [y, x]. Trailing blank lines are dropped.
+def parse_camera_image(output):
+    rows = bytes(output).split(b"\n")
+    rows = [r for r in rows if r]
+    width = len(rows[0])
+    assert(all(len(r) == width for r in rows))
+    return np.frombuffer(b"".join(rows), dtype="S1").reshape(len(rows), width)
+
+# Returns a boolean array that's True wherever there's scaffold (the robot is
+# always on the scaffold, unless it's fallen off).
+def scaffold_mask(image):
+    return np.isin(image, [b"#"] + list(ROBOT_FACING.keys()))
+
+# Returns a boolean array that's True for every scaffold intersection, ie. any
+# scaffold cell with scaffold on all four sides.
+def intersection_mask(image):
+    # Pad with a border of empty space so we can shift the mask without
+    # wrapping around.
+    m = np.pad(scaffold_mask(image), 1)
+    return (m[1:-1, 1:-1] &
+            m[:-2, 1:-1] & # N
+            m[2:, 1:-1] &  # S
+            m[1:-1, :-2] & # W
+            m[1:-1, 2:])   # E
+
+# The "alignment parameter" of an intersection is its x coordinate times its y
+# coordinate; part 1 wants the sum over all of them.
+def alignment_parameters(image):
+    ys, xs = np.nonzero(intersection_mask(image))
+    return int(np.sum(xs * ys))
+
+# Returns the robot's position and the direction it's facing (as a unit
+# vector, +y is down), or None if the robot isn't on the scaffold.
+def find_robot(image):
+    for c, facing in ROBOT_FACING.items():
+        ys, xs = np.nonzero(image == c)
+        if len(xs):
+            return Point(int(xs[0]), int(ys[0])), facing
+    return None
+
+# To solve part 2, we need to find a path that visits all points on the
+# scaffold, and which we can express as a "movement routine" composed of three
+# "movement functions" we define ("A", "B", and "C"; for example "A,B,C"). Each
+# movement function can be composed of three insructions: turn left ("L"),
+# turn right ("R"), or a number to indicate the robot should move forward N
+# units in the direction it is currently facing (e.g. "L,2,R,8"). Finally each
+# of these routines, including the main routine, can be at most 20 characters
+# (not counting the terminating newline).
+#
+# We start by finding a path that visits every point on the scaffold, then we
+# try to break that down into a program that fits in our constraints. Since we
+# don't care if the path is short (we just need a short enough program) we can
+# use a greedy approach: go straight until we can't, then turn whichever way
+# the scaffold goes.
+#
+# Returns the path as a list of (turn, distance) moves, e.g. [("R", 8)].
+def find_scaffold_path(image):
+    mask = scaffold_mask(image)
+    height, width = mask.shape
+    pos, facing = find_robot(image)
+
+    def is_scaffold(p):
+        return 0 <= p.x < width and 0 <= p.y < height and mask[p.y, p.x]
+
+    path = []
+    while True:
+        # Remember +y is down, so turning left takes (x, y) to (y, -x).
+        left = Point(facing.y, -facing.x)
+        right = Point(-facing.y, facing.x)
+        if is_scaffold(pos.translate(left.x, left.y)):
+            turn, facing = "L", left
+        elif is_scaffold(pos.translate(right.x, right.y)):
+            turn, facing = "R", right
+        else:
+            # Dead end; we've reached the other end of the scaffold.
+            break
+
+        distance = 0
+        while is_scaffold(pos.translate(facing.x, facing.y)):
+            pos = pos.translate(facing.x, facing.y)
+            distance += 1
+        path.append((turn, distance))
+    return path
+
+# Formats a list of moves the way the robot wants them, e.g. "R,8,L,10".
+def format_moves(moves):
+    return ",".join(f"{turn},{distance}" for turn, distance in moves)
+
+MovementRoutines = namedtuple("MovementRoutines", ["main", "functions"])
+
+# Searches for a way to write a path as a main routine which only calls
+# movement functions, none of them longer than max_length characters.
+#
+# We walk along the path; at each point we either call a function we've
+# already defined (if the path continues with that function's moves) or define
+# the next function as the next 1, 2, ... moves, stopping once the function
+# would be too long. Positions that we know can't be finished from a given set
+# of functions are remembered so we don't search them again.
+class PathCompressor(object):
+    def __init__(self, max_length=20, function_names="ABC", time_budget=None):
+        self.max_length = max_length
+        self.function_names = function_names
+        # Each call in the main routine takes two characters (name + ","),
+        # except the last one.
+        self.max_calls = (max_length + 1) // 2
+        # Give up after this many seconds (None means never give up).
+        self.time_budget = time_budget
+        # The number of candidate function definitions we tried.
+        self.candidates = 0
+        self.timed_out = False
+
+    # Returns a MovementRoutines, or None if there's no way to compress the
+    # path (or we ran out of time looking).
+    def compress(self, path):
+        self.candidates = 0
+        self.timed_out = False
+        deadline = None
+        if self.time_budget is not None:
+            deadline = time.monotonic() + self.time_budget
+        path = tuple(path)
+        dead_ends = set()
+
+        def search(i, functions, main):
+            if i == len(path):
+                return MovementRoutines(main, functions)
+            if len(main) == self.max_calls:
+                return None
+            key = (i, functions, len(main))
+            if key in dead_ends:
+                return None
+            if deadline is not None and time.monotonic() > deadline:
+                self.timed_out = True
+                return None
+
+            # Try calling the functions we already have.
+            for name, function in zip(self.function_names, functions):
+                if path[i:i + len(function)] == function:
+                    result = search(i + len(function), functions, main + [name])
+                    if result or self.timed_out:
+                        return result
+
+            # Try defining a new function, starting here.
+            if len(functions) < len(self.function_names):
+                name = self.function_names[len(functions)]
+                length = -1 # no comma before the first move
+                for j in range(i, len(path)):
+                    turn, distance = path[j]
+                    length += len(turn) + len(str(distance)) + 2
+                    if length > self.max_length:
+                        break
+                    self.candidates += 1
+                    result = search(
+                        j + 1, functions + (path[i:j + 1],), main + [name])
+                    if result or self.timed_out:
+                        return result
+
+            dead_ends.add(key)
+            return None
+
+        return search(0, (), [])
+
+# "Compile" a movement routine into a list of "ASCII codes".
+def compile(prog):
+    l = [ord(x) for x in prog] + [ord("\n")]
+    # Reverse since we want to pop() instructions off to return them from
+    # input_fn, below.
+    l.reverse()
+    return l
+
+# Gets the camera image and works out the movement routines for part 2.
+def plan_routines(program, time_budget=10.0):
+    image = capture_camera_image(program)
+    path = find_scaffold_path(image)
+    compressor = PathCompressor(time_budget=time_budget)
+    routines = compressor.compress(path)
+    if not routines:
+        reason = "ran out of time" if compressor.timed_out else "no solution"
+        raise ValueError(
+            f"Can't compress path {format_moves(path)} ({reason} after "
+            f"trying {compressor.candidates} candidates)!")
+    return routines, compressor.candidates
 
 def curses_main(stdscr):
     pad_width = 75
@@ -22,15 +226,12 @@ def curses_main(stdscr):
     # "window".
     pad.box()
 
+    renderer = Renderer(CursesBackend(pad, pad_width, pad_height))
+
     # Seed random so that we always get the same sequence of random choices
     # for the robot.
     random.seed(0)
 
-    def refresh_pad(pad):
-        width = min(pad_width, curses.COLS - 1)
-        height = min(pad_height, curses.LINES - 1)
-        pad.refresh(0, 0, 0, 0, height, width)
-
     log_file = open("run.log", "w")
 
     def log(msg):
@@ -59,8 +260,8 @@ def curses_main(stdscr):
                     y += 1
                     x = 1
             else:
-                pad.addch(y, x, c)
-                refresh_pad(pad)
+                renderer.set_char(x, y, c)
+                renderer.flush()
                 x += 1
             last_output = c
 
@@ -72,24 +273,22 @@ def curses_main(stdscr):
         INPUT_VIDEO = auto()
         INPUT_DONE = auto()
 
-    # "Compile" a movement routine into a list of "ASCII codes".
-    def compile(prog):
-        l = [ord(x) for x in prog] + [ord("\n")]
-        # Reverse since we want to pop() instructions off to return them from
-        # input_fn, below.
-        l.reverse()
-        return l
-
     def get_next_move(prog, state, next_state):
         v = prog.pop()
         s = state if v != ord("\n") else next_state
         return (v, s)
 
+    program = intcode.read_initial_memory("input")
+    routines, _ = plan_routines(program)
+    # The robot always asks for all three functions, even if we don't use
+    # them.
+    functions = list(routines.functions) + [()] * (3 - len(routines.functions))
+
     input_state = InputState.INPUT_MAIN
-    move_main = compile("A")
-    move_a = compile("R,2")
-    move_b = compile("R,2")
-    move_c = compile("R,2")
+    move_main = compile(",".join(routines.main))
+    move_a = compile(format_moves(functions[0]))
+    move_b = compile(format_moves(functions[1]))
+    move_c = compile(format_moves(functions[2]))
     want_video = compile("y")
 
     def input_fn(_):
@@ -122,7 +321,6 @@ def curses_main(stdscr):
         log(f"[input] Returning move {next_move}, next state is {input_state}.")
         return next_move
 
-    program = intcode.read_initial_memory("input")
     program[0] = 2 # "wake up" the robot
     im = intcode.IntcodeMachine(
         program,
@@ -132,84 +330,73 @@ def curses_main(stdscr):
     im.run()
 
     # wait for keypress before exiting
+    renderer.flush(force=True)
     pad.getch()
 
-    # Get a character from the pad, handling the ALT_CHARSET crap.
-    def get_char(x, y):
-        c = pad.inch(y, x)
-        # log(f"[get_char] x = {x}, y = {y}, c = {hex(c)}.")
-        if c & curses.A_ALTCHARSET:
-            if c == curses.ACS_ULCORNER:
-                return u"\u250c"
-            elif c == curses.ACS_HLINE:
-                return u"\u2500"
-            elif c == curses.ACS_URCORNER:
-                return u"\u2510"
-            elif c == curses.ACS_VLINE:
-                return u"\u2502"
-            elif c == curses.ACS_LLCORNER:
-                return u"\u2514"
-            elif c == curses.ACS_LRCORNER:
-                return u"\u2518"
-            return ''
-        return chr(c & ~curses.A_ATTRIBUTES)
-
-    # Now that we have the pad contents, compute the "alignment parameters".
-    # The pad isn't that big, we can just loop over all characters to get the
-    # intersections.
-    #
-    # This was only needed for part 1.
-    # total = 0
-    # for row in range(0, pad_height):
-    #     for col in range(0, pad_width):
-    #         c = get_char(col, row)
-    #         if c == "#":
-    #             neighbors = [
-    #                 (col,     row - 1), # N
-    #                 (col + 1, row    ), # E
-    #                 (col,     row + 1), # S
-    #                 (col - 1, row    ), # W
-    #             ]
-    #             intersection = True
-    #             for n in neighbors:
-    #                 if get_char(n[0], n[1]) != "#":
-    #                     intersection = False
-    #             if intersection:
-    #                 # Note that we offset all of the coordinates to draw the
-    #                 # border...
-    #                 total += (row - 1) * (col - 1)
-    #                 pad.addch(row, col, "O")
-    # refresh_pad(pad)
-    # pad.getch()
-
-    # Now to solve part 2, we need to find a path that visits all points on the
-    # scaffold, and which we can express as a "movement routine" composed of
-    # three "movement functions" we define ("A", "B", and "C"; for example
-    # "A,B,C"). Each movement function can be composed of three insructions:
-    # turn left ("L"), turn right ("R"), or a number to indicate the robot
-    # should move forward N units in the direction it is currently facing (e.g.
-    # "L,2,R,8"). Finally each of these routines, including the main routine,
-    # can be at most 20 characters (not counting the terminating newline).
-    #
-    # Let's start by finding a path that visits every point on the scaffold,
-    # then we can try to figure out how to break that down into a program that
-    # fits in our constraints (and if that's not possible, we'll backout and
-    # find a different path, I guess).
-    #
-    # Since we don't care if the path is short (we just need a short enough
-    # program) we can use a greedy approach.
-
-    # Capture pad contents.
-    pad_contents = ""
-    for row in range(0, pad_height):
-        for col in range(0, pad_width):
-            pad_contents += get_char(col, row)
-        pad_contents += "\n"
+    # Part 1 (the "alignment parameters") is solved without the pad; see
+    # alignment_parameters() and headless_main().
+
+    # Capture the last frame drawn.
+    pad_contents = renderer.snapshot()
 
     return pad_contents, total_dust
 
+# Wakes up the robot and runs the given movement routines, with the video feed
+# turned off. Returns the amount of dust collected.
+def run_vacuum_robot(program, routines):
+    functions = list(routines.functions) + [()] * (3 - len(routines.functions))
+    lines = [",".join(routines.main)] + [format_moves(f) for f in functions]
+    commands = compile("\n".join(lines + ["n"]))
+
+    total_dust = None
+    def output_fn(v):
+        nonlocal total_dust
+        # If we get a non-ASCII value, it's our score.
+        if v > 127:
+            total_dust = v
+
+    program = program.copy()
+    program[0] = 2 # "wake up" the robot
+    im = intcode.IntcodeMachine(
+        program,
+        input_fn=lambda _: commands.pop(),
+        output_fn=output_fn,
+    )
+    im.run()
+    return total_dust
+
+# Gets the camera image and solves both parts without drawing anything.
+def headless_main():
+    program = intcode.read_initial_memory("input")
+    image = capture_camera_image(program)
+    for row in image:
+        print(b"".join(row).decode("ascii"))
+    print(f"Sum of alignment parameters is {alignment_parameters(image)}.")
+    robot = find_robot(image)
+    if robot:
+        pos, facing = robot
+        print(f"Robot is at {pos}, facing {facing}.")
+    else:
+        print("Robot has fallen off the scaffold!")
+        return
+
+    routines, candidates = plan_routines(program)
+    print(f"Found movement routines after trying {candidates} candidates:")
+    print(f"  Main: {','.join(routines.main)}")
+    for name, function in zip("ABC", routines.functions):
+        print(f"  {name}: {format_moves(function)}")
+    print(f"Collected {run_vacuum_robot(program, routines)} dust.")
+
 if __name__ == "__main__":
-    pad_contents, total_dust = curses.wrapper(curses_main)
-    print(pad_contents)
-    print(f"Collected {total_dust} dust.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true",
+                        help="solve both parts without drawing anything")
+    args = parser.parse_args()
+
+    if args.headless:
+        headless_main()
+    else:
+        pad_contents, total_dust = curses.wrapper(curses_main)
+        print(pad_contents)
+        print(f"Collected {total_dust} dust.")
     print("Be seeing you...")
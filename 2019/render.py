@@ -0,0 +1,106 @@
+# Shared rendering for the puzzles that draw a map while they run (days 11, 15
+# and 17).
+#
+# Drawing into a Renderer only records the new contents of the cell and marks
+# it "dirty". Dirty cells are pushed to the backend when flush() is called, and
+# then at most max_fps times per second, so a program that moves thousands of
+# times a second doesn't spend all of its time waiting on the terminal. With no
+# backend the renderer is headless: nothing is ever drawn, but snapshot() still
+# returns the final frame.
+
+import curses
+import sys
+import time
+
+class Renderer(object):
+    # max_fps=None means draw on every call to flush().
+    def __init__(self, backend=None, max_fps=30):
+        self.backend = backend
+        self.max_fps = max_fps
+        # Current contents of every cell that's been drawn, as a map from
+        # (x, y) to (char, color).
+        self.cells = {}
+        # Cells which have changed since the last time we drew the frame.
+        self.dirty = set()
+        self.last_flush = None
+
+    def is_headless(self):
+        return self.backend is None
+
+    def set_char(self, x, y, c, color=0):
+        if self.cells.get((x, y)) == (c, color):
+            return
+        self.cells[(x, y)] = (c, color)
+        # No point tracking changes we're never going to draw.
+        if self.backend:
+            self.dirty.add((x, y))
+
+    def get_char(self, x, y, default=' '):
+        try:
+            return self.cells[(x, y)][0]
+        except KeyError:
+            return default
+
+    # Draw any changes since the last frame. Unless force is set this does
+    # nothing if we drew a frame less than 1 / max_fps seconds ago. Returns
+    # True if a frame was drawn.
+    def flush(self, force=False):
+        if not self.backend or (not self.dirty and not force):
+            return False
+        now = time.monotonic()
+        if (not force and self.max_fps and self.last_flush is not None and
+                now - self.last_flush < 1.0 / self.max_fps):
+            return False
+        self.backend.draw(self, self.dirty)
+        self.dirty = set()
+        self.last_flush = now
+        return True
+
+    # Returns the bounds of everything drawn so far, as (left, top, right,
+    # bottom), inclusive; +y is down.
+    def get_bounds(self):
+        if not self.cells:
+            return (0, 0, 0, 0)
+        xs = [x for x, _ in self.cells]
+        ys = [y for _, y in self.cells]
+        return (min(xs), min(ys), max(xs), max(ys))
+
+    # Returns the current frame as a string, one line per row. Cells that were
+    # never drawn are filled with fill.
+    def snapshot(self, padding=0, fill=' '):
+        left, top, right, bottom = self.get_bounds()
+        rows = []
+        for y in range(top - padding, bottom + padding + 1):
+            rows.append(''.join(
+                self.get_char(x, y, fill)
+                for x in range(left - padding, right + padding + 1)))
+        return '\n'.join(rows)
+
+# Draws into a curses pad. Colors are curses color pair numbers; the caller is
+# responsible for setting them up with curses.init_pair.
+class CursesBackend(object):
+    def __init__(self, pad, pad_width, pad_height):
+        self.pad = pad
+        self.pad_width = pad_width
+        self.pad_height = pad_height
+
+    def draw(self, renderer, dirty):
+        for x, y in dirty:
+            c, color = renderer.cells[(x, y)]
+            self.pad.addch(y, x, c, curses.color_pair(color))
+        width = min(self.pad_width, curses.COLS - 1)
+        height = min(self.pad_height, curses.LINES - 1)
+        self.pad.refresh(0, 0, 0, 0, height, width)
+
+# Prints the whole frame to a file (stdout by default). Colors are ignored.
+class PrintBackend(object):
+    def __init__(self, file=None, padding=0, fill=' '):
+        self.file = file
+        self.padding = padding
+        self.fill = fill
+
+    def draw(self, renderer, dirty):
+        # Look up stdout when we draw, in case it's been redirected.
+        file = self.file or sys.stdout
+        print(renderer.snapshot(self.padding, self.fill), file=file)
+        print(file=file)